@@ -4,8 +4,15 @@ from tornado.web import RequestHandler
 
 
 class BaseRequestHandler(RequestHandler):
+    # requests being handled, a stopping server waits for them
+    active = 0
+
     def __init__(self, application, request, **kwargs):
         super().__init__(application, request, **kwargs)
+        BaseRequestHandler.active += 1
+
+    def on_finish(self):
+        BaseRequestHandler.active -= 1
 
     def get_current_user(self):
         if not self.get_cookie("session_uid"):
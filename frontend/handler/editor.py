@@ -2,7 +2,6 @@ from enum import Enum
 from itertools import chain
 from typing import Optional
 from uuid import uuid4, UUID
-from weakref import WeakKeyDictionary
 from version import BUILDER_VERSION
 from bidict import bidict
 from tornado.httputil import url_concat
@@ -127,8 +126,10 @@ class EditorSession:
         self._handles = bidict()
         # keys: children nodes, values: parent nodes
         self._parent_links = {}
+        # commands which subtrees aren't indexed yet
+        self._pending = {}
 
-        self._add_children_handles(self._draft)
+        self._add_children_handles(self._draft, lazy=True)
 
     @property
     def protocol(self):
@@ -138,17 +139,17 @@ class EditorSession:
         breadcrumb = []
         kind = self.get_kind_by_handle(handle)
         if kind is ResourceKind.command:
-            cmd = self._handles[handle]
+            cmd = self._resolve(handle)
             breadcrumb.append({"name": cmd.name,
                                "value": url_concat(handler.reverse_url("editor")[1:],
                                                    {"action": "view", "handle": handle})})
         elif kind is ResourceKind.accessor:
-            acc = self._handles[handle]
+            acc = self._resolve(handle)
             breadcrumb.append({"name": acc.name,
                                "value": url_concat(handler.reverse_url("editor")[1:],
                                                    {"action": "view", "handle": handle})})
         elif kind is ResourceKind.argument:
-            arg = self._handles[handle]
+            arg = self._resolve(handle)
             msg = self._parent_links[arg]
             cmd = self._parent_links[msg]
 
@@ -163,7 +164,7 @@ class EditorSession:
                                "value": url_concat(handler.reverse_url("editor")[1:],
                                                    {"action": "view", "handle": handle})})
         elif kind is ResourceKind.constant:
-            con = self._handles[handle]
+            con = self._resolve(handle)
             arg = self._parent_links[con]
             msg = self._parent_links[arg]
             cmd = self._parent_links[msg]
@@ -184,17 +185,17 @@ class EditorSession:
         return breadcrumb
 
     def get_kind_by_handle(self, handle):
-        if handle not in self._handles:
+        try:
+            resource = self._resolve(handle)
+        except KeyError:
             raise ValueError
-
-        resource = self._handles[handle]
         kind = next((m for m in ResourceKind if isinstance(resource, m.value)), None)
 
         assert kind is not None
         return kind
 
     def if_request_by_handle(self, handle):
-        msg = self._handles[handle]
+        msg = self._resolve(handle)
         cmd = self._parent_links[msg]
         assert isinstance(cmd, ast.Command)
         if cmd.request == msg:
@@ -202,14 +203,14 @@ class EditorSession:
         return False
 
     def cmd_by_message(self, handle):
-        msg = self._handles[handle]
+        msg = self._resolve(handle)
         cmd = self._parent_links[msg]
         assert isinstance(cmd, ast.Command)
         return cmd.uid
 
     def get_prev_id(self, handle, default_val=""):
         kind = self.get_kind_by_handle(handle)
-        elem = self._handles[handle]
+        elem = self._resolve(handle)
         parent = self._parent_links[elem]
 
         elements = list(parent.children)
@@ -231,22 +232,55 @@ class EditorSession:
             return ""
         return str(elements[prev_command_index].uid)
 
-    def _add_children_handles(self, node, parent=None):
+    # Subtrees of commands are indexed lazily once any node of a command or its accessor is asked for, so opening
+    # a lazily loaded project doesn't load all of them
+    def _add_children_handles(self, node, parent=None, lazy=False):
         self._handles[node.uid] = node
         self._parent_links[node] = parent
+        if lazy and isinstance(node, ast.Command):
+            self._pending[node] = None
+            return
         for c in node.children:
-            self._add_children_handles(c, node)
+            self._add_children_handles(c, node, lazy)
+
+    def _expand_handles(self, node):
+        if isinstance(node, Accessor):
+            commands = node.children
+        elif node in self._pending:
+            parent = self._parent_links[node]
+            # both accessor commands are edited together
+            commands = parent.children if isinstance(parent, Accessor) else (node,)
+        else:
+            return
+        for cmd in commands:
+            if cmd in self._pending:
+                del self._pending[cmd]
+                for c in cmd.children:
+                    self._add_children_handles(c, cmd)
+
+    def _resolve(self, handle):
+        node = self._handles.get(handle)
+        while node is None and self._pending:
+            self._expand_handles(next(iter(self._pending)))
+            node = self._handles.get(handle)
+        if node is None:
+            raise KeyError(handle)
+        self._expand_handles(node)
+        return node
 
     def _purge_children_handles(self, node):
         del self._handles.inv[node]
         del self._parent_links[node]
+        if node in self._pending:
+            del self._pending[node]
+            return
         for c in node.children:
             self._purge_children_handles(c)
 
     def update_protocol(self, handle, project_name=None, version=None, extra_options: Optional[str] = None):
         assert self._draft
 
-        protocol = self._handles[handle]
+        protocol = self._resolve(handle)
 
         assert isinstance(protocol, AccessorProtocol)
 
@@ -262,7 +296,7 @@ class EditorSession:
     def update_command(self, handle, cid=None, name=None, descrs=None, extra_options: Optional[str] = None):
         assert self._draft
 
-        cmd = self._handles[handle]
+        cmd = self._resolve(handle)
 
         assert isinstance(cmd, ast.Command)
 
@@ -279,10 +313,17 @@ class EditorSession:
     def update_accessor(self, handle=None, aid=None, name=None, descrs=None, extra_options: Optional[str] = None):
         assert self._draft
 
-        acc = self._handles[handle]
+        acc = self._resolve(handle)
 
         assert isinstance(acc, Accessor)
 
+        # check CIDs before anything is changed
+        protocol = self._parent_links[acc].wrapped
+        for cmd, cid in ((acc.getter, "g" + aid), (acc.setter, "s" + aid)):
+            other = protocol.command_by_cid(cid)
+            if other is not None and other is not cmd:
+                raise ValueError("CID {} is already used by {} command".format(cid, other.name))
+
         acc.aid = aid
         acc.getter.cid = "g" + aid
         acc.setter.cid = "s" + aid
@@ -308,7 +349,7 @@ class EditorSession:
 
             a.extra_options = extra_options
 
-        arg = self._handles[handle]
+        arg = self._resolve(handle)
         msg = self._parent_links[arg]
         cmd = self._parent_links[msg]
 
@@ -339,7 +380,7 @@ class EditorSession:
             for code, text in descrs.items():
                 con.description[code] = text
 
-        const = self._handles[handle]
+        const = self._resolve(handle)
 
         arg = self._parent_links[const]
         msg = self._parent_links[arg]
@@ -367,14 +408,14 @@ class EditorSession:
     def create_command(self, parent_handle, cid, name):
         assert self._draft
 
-        protocol = self._handles[parent_handle]
+        protocol = self._resolve(parent_handle)
 
         assert isinstance(protocol, AccessorProtocol)
 
         cmd = ast.Command(cid=cid, name=name)
 
-        protocol.children.append(cmd)
         protocol.wrapped.commands.append(cmd)
+        protocol.children.append(cmd)
 
         self._add_children_handles(cmd, protocol)
 
@@ -382,7 +423,7 @@ class EditorSession:
 
     def create_accessor(self, parent_handle, aid, name, extra=None):
         assert self._draft
-        protocol = self._handles[parent_handle]
+        protocol = self._resolve(parent_handle)
 
         assert isinstance(protocol, AccessorProtocol)
 
@@ -392,6 +433,8 @@ class EditorSession:
         except ValueError:
             raise ValueError("AID must be exactly 3 bytes string")
 
+        if protocol.wrapped.command_by_cid(getter.cid) or protocol.wrapped.command_by_cid(setter.cid):
+            raise ValueError("AID {} is already used".format(aid))
         protocol.wrapped.commands.append(getter)
         protocol.wrapped.commands.append(setter)
         acc = Accessor(aid=aid, name=name, getter=getter, setter=setter, uid=uuid4(), extra_options=extra)
@@ -403,7 +446,7 @@ class EditorSession:
 
     def create_argument(self, handle, name, _type):
         assert self._draft
-        obj = self._handles[handle]
+        obj = self._resolve(handle)
         if isinstance(obj, Accessor):
             arg1, arg2 = (ast.Argument(type_=_type, name=name), ast.Argument(type_=_type, name=name))
             obj.getter.response.args.append(arg1)
@@ -424,7 +467,7 @@ class EditorSession:
     def create_constant(self, handle, name, value):
         assert self._draft
 
-        arg = self._handles[handle]
+        arg = self._resolve(handle)
         msg = self._parent_links[arg]
         cmd = self._parent_links[msg]
 
@@ -455,7 +498,7 @@ class EditorSession:
     def delete_command(self, handle):
         assert self._draft
 
-        cmd = self._handles[handle]
+        cmd = self._resolve(handle)
         protocol = self._parent_links[cmd]
 
         assert isinstance(cmd, ast.Command)
@@ -469,7 +512,7 @@ class EditorSession:
     def delete_accessor(self, handle):
         assert self._draft
 
-        acc = self._handles[handle]
+        acc = self._resolve(handle)
         protocol = self._parent_links[acc]
 
         assert isinstance(acc, Accessor)
@@ -485,7 +528,7 @@ class EditorSession:
     def delete_argument(self, handle):
         assert self._draft
 
-        arg = self._handles[handle]
+        arg = self._resolve(handle)
         msg = self._parent_links[arg]
         cmd = self._parent_links[msg]
 
@@ -517,7 +560,7 @@ class EditorSession:
     def delete_constant(self, handle):
         assert self._draft
 
-        const = self._handles[handle]
+        const = self._resolve(handle)
         assert isinstance(const, ast.FlagConstant)
 
         arg = self._parent_links[const]
@@ -549,7 +592,7 @@ class EditorSession:
     def move_argument(self, handle, offset):
         assert self._draft
 
-        arg = self._handles[handle]
+        arg = self._resolve(handle)
         msg = self._parent_links[arg]
         cmd = self._parent_links[msg]
 
@@ -582,7 +625,7 @@ class EditorSession:
     def read_protocol(self, handle):
         assert self._draft
 
-        protocol = self._handles[handle]
+        protocol = self._resolve(handle)
 
         assert isinstance(protocol, AccessorProtocol)
 
@@ -591,7 +634,7 @@ class EditorSession:
     def read_command(self, handle):
         assert self._draft
 
-        cmd = self._handles[handle]
+        cmd = self._resolve(handle)
         assert isinstance(cmd, ast.Command)
 
         return cmd
@@ -599,7 +642,7 @@ class EditorSession:
     def read_accessor(self, handle):
         assert self._draft
 
-        acc = self._handles[handle]
+        acc = self._resolve(handle)
         assert isinstance(acc, Accessor)
 
         return acc
@@ -607,7 +650,7 @@ class EditorSession:
     def read_argument(self, handle):
         assert self._draft
 
-        argument = self._handles[handle]
+        argument = self._resolve(handle)
         assert isinstance(argument, ast.Argument)
 
         return argument
@@ -615,38 +658,32 @@ class EditorSession:
     def read_constant(self, handle=None):
         assert self._draft
 
-        constant = self._handles[handle]
+        constant = self._resolve(handle)
         assert isinstance(constant, ast.FlagConstant)
 
         return constant
 
 
 class EditorHandler(BaseRequestHandler):
-    # may create bugs in multithreaded code but should be completely fine when used singlethreaded
-    # editor is cleared from memory when SessionManager dumps protocol from RAM cache to disk
-    _cached_editors = WeakKeyDictionary()
     messages = {}
 
     def __init__(self, application, request, sessions, **kwargs):
         super().__init__(application, request, **kwargs)
 
-        protocol = sessions[self.current_user]
+        self._sessions = sessions
+        self._editor = None
         self.breadcrumbs = []
 
-        # WeakValues" setdefault() method apparently has some kind of bug
-        if protocol in self._cached_editors:
-            self._editor = self._cached_editors[protocol]
-        else:
-            self._editor = EditorSession(protocol)
-            self._cached_editors[protocol] = self._editor
+    async def prepare(self):
+        # the project may have to be loaded, which is done off the event loop
+        await self._sessions.get(self.current_user)
+        # editor is cleared from memory when SessionManager removes the project from RAM
+        self._editor = self._sessions.derived(self.current_user, EditorSession)
 
     def get_extra_options_dict(self, cmd):
-        res = []
-        if cmd.extra_options:
-            for sub in cmd.extra_options.split(","):
-                if "=" in sub:
-                    res.append(map(str.strip, sub.split("=", 1)))
-        return dict(res)
+        # accessors aren't AST nodes, so the options are parsed from the string, parsing is cached anyway
+        options = ast.parse_extra_options(cmd.extra_options)
+        return {key: value for key, value in options.items() if value is not None}
 
     def get_tags(self, cmd):
         """
@@ -656,13 +693,13 @@ class EditorHandler(BaseRequestHandler):
         :param cmd: Command to look for extra options with tags
         :return: list of enabled tags filename for the command
         """
-        options = self.get_extra_options_dict(cmd)
+        options = ast.parse_extra_options(cmd.extra_options)
         # To get constant relative path to tags directory we need to start with this file path, not volatile pwd
         tagsdirpath = path.join(path.dirname(__file__), "..", "static", "tags")
         tags_available = [path.splitext(f)[0] for f in listdir(tagsdirpath) if path.splitext(f)[1] == ".png"]
         res = []
         for tag in tags_available:
-            if tag in options and options[tag].lower() in ("true", "1"):
+            if options.get_bool(tag):
                 res.append(tag + ".png")
         return res
 
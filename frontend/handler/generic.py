@@ -8,8 +8,8 @@ class MainHandler(BaseRequestHandler):
         super().__init__(application, request, **kwargs)
         self._sessions = sessions
 
-    def get(self, action=None):
-        protocol = self._sessions[self.current_user]
+    async def get(self, action=None):
+        protocol = await self._sessions.get(self.current_user)
         self.redirect(url_concat(self.reverse_url("editor"), {"action": "view", "handle": protocol.uid}))
 
 
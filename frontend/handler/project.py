@@ -1,5 +1,4 @@
 import os
-import copy
 from io import BytesIO
 
 from tornado.httputil import url_concat
@@ -30,94 +29,111 @@ def _normalize_target_name(protocol, target, subtarget=None):
     return "{}({})".format(target_name, subtarget) if subtarget else target_name
 
 
+# builders run by BuildPool take the protocol and the output first
+def _build_profiles(protocol, output, profiles_list):
+    profiles.build(protocol, profiles_list, output, is_namespaced=True)
+
+
+def _build_style_profiles(protocol, output, profiles_list, style):
+    pythonprofiles.style_build(protocol, profiles_list, output, is_namespaced=True, style=style)
+
+
 class ProjectHandler(BaseRequestHandler):
-    def __init__(self, application, request, sessions, **kwargs):
+    def __init__(self, application, request, sessions, builds, **kwargs):
         super().__init__(application, request, **kwargs)
 
         self._sessions = sessions
+        # generation is done by worker processes, see BuildPool
+        self._builds = builds
 
         self._json_storage = JsonStorage()
         self._oldxi_storage = OldxiStorage()
 
-    def _generate_firmware(self, protocol, output_buffer):
+    async def _build(self, output_buffer, build, protocol, *args, **kwargs):
+        # the output is addressed by its content, so a client having the output gets 304 without building it
+        self.set_header("Etag", '"{}"'.format(await self._builds.tag(build, protocol, *args, **kwargs)))
+        if self.request.method == "GET" and self.check_etag_header():
+            self._builds.forget(protocol)
+            self.set_status(304)
+            return
+        output_buffer.write(await self._builds.build(build, protocol, *args, **kwargs))
+
+    async def _generate_firmware(self, protocol, output_buffer):
         device_type = self.get_query_argument("device")
         file_name = "{}.zip".format(_normalize_target_name(protocol, "firmware", device_type))
 
         if device_type == "K1921BK01T":
-            firmware.build_K1921BK01T(protocol, output_buffer)
+            build = firmware.build_K1921BK01T
         elif device_type == "K1921BK01T-UART":
-            firmware.build_K1921BK01T_UART(protocol, output_buffer)
+            build = firmware.build_K1921BK01T_UART
         elif device_type == "K1986BE92QI":
-            firmware.build_K1986BE92QI(protocol, output_buffer)
+            build = firmware.build_K1986BE92QI
         elif device_type == "K1986BE92QI-UART":
-            firmware.build_K1986BE92QI_UART(protocol, output_buffer)
+            build = firmware.build_K1986BE92QI_UART
         elif device_type == "TM4C1294KCPDT":
-            firmware.build_TM4C1294KCPDT(protocol, output_buffer)
+            build = firmware.build_TM4C1294KCPDT
         elif device_type == "LM3S5R31":
-            firmware.build_LM3S5R31(protocol, output_buffer)
+            build = firmware.build_LM3S5R31
         elif device_type == "STM32F103C6":
-            firmware.build_STM32F103C6(protocol, output_buffer)
+            build = firmware.build_STM32F103C6
         elif device_type == "STM32F103C6-UART":
-            firmware.build_STM32F103C6_UART(protocol, output_buffer)
+            build = firmware.build_STM32F103C6_UART
         elif device_type == "STM32L053C8":
-            firmware.build_STM32L053C8(protocol, output_buffer)
+            build = firmware.build_STM32L053C8
         elif device_type == "STM32L053C8-UART":
-            firmware.build_STM32L053C8_UART(protocol, output_buffer)
+            build = firmware.build_STM32L053C8_UART
         elif device_type == "STM32F429ZI":
-            firmware.build_STM32F429ZI(protocol, output_buffer)
+            build = firmware.build_STM32F429ZI
         elif device_type == "STM32F429ZI-UART":
-            firmware.build_STM32F429ZI_UART(protocol, output_buffer)
+            build = firmware.build_STM32F429ZI_UART
         else:
             raise ValueError("Unknown firmware generation ")
+        await self._build(output_buffer, build, protocol)
         mime = "application/zip"
         return file_name, mime
 
-    def _generate_doc(self, protocol, output_buffer):
+    async def _generate_doc(self, protocol, output_buffer):
         doc_format = self.get_query_argument("format")
 
         if doc_format == "Textile":
-            textile.build(protocol, output_buffer, "ru")
+            await self._build(output_buffer, textile.build, protocol, "ru")
             file_name = "{}.zip".format(_normalize_target_name(protocol, "wiki"))
             mime = "application/zip"
         elif doc_format == "Markdown":
-            markdown.build(protocol, output_buffer, "ru")
+            await self._build(output_buffer, markdown.build, protocol, "ru")
             file_name = "{}.zip".format(_normalize_target_name(protocol, "markdown"))
             mime = "application/zip"
         elif doc_format == "Sphinx":
-            sphinx.build(protocol, output_buffer)
+            await self._build(output_buffer, sphinx.build, protocol)
             file_name = "{}.zip".format(_normalize_target_name(protocol, "sphinx"))
             mime = "application/zip"
         else:
             raise ValueError("Unknown documentation generation")
         return file_name, mime
 
-    def _generate_bind(self, protocol, output_buffer):
+    async def _generate_bind(self, protocol, output_buffer):
         lang_name = self.get_query_argument("format", "").lower()
 
         if lang_name == "python":
-            bindings.python.build(protocol, output_buffer)
+            await self._build(output_buffer, bindings.python.build, protocol)
         elif lang_name == "c#":
-            bindings.csharp.build(protocol, output_buffer)
+            await self._build(output_buffer, bindings.csharp.build, protocol)
         else:
             raise ValueError("Unknown bindings generation request")
         file_name = "{}.zip".format(_normalize_target_name(protocol, "bindings", lang_name))
         mime = "application/zip"
         return file_name, mime
 
-    def _remove_service_commands(self):
+    async def _remove_service_commands(self):
         to_delete = set()
-        protocol = copy.deepcopy(self._sessions[self.current_user])
+        protocol = (await self._sessions.get(self.current_user)).fork()
         for command in protocol.commands:
-            # Bring option string to lowercase, split by separator
-            for opt in command.extra_options.lower().split(","):
-                # remove whitespace from option
-                opt = "".join(opt.split())
-                if "is_service_command=true" in opt:
-                    to_delete.add(command)
+            if command.options.get_bool("is_service_command"):
+                to_delete.add(command)
         for command in to_delete:
             protocol.children.remove(command)
 
-        self._sessions[self.current_user] = protocol
+        await self._sessions.set(self.current_user, protocol)
 
     def _assembly_profiles_list(self, protocol):
         if not self.request.files:
@@ -132,8 +148,9 @@ class ProjectHandler(BaseRequestHandler):
 
         return profiles_list
 
-    def get(self, action):
-        protocol = self._sessions[self.current_user]
+    async def get(self, action):
+        # generators work on a frozen view, the editor may change the session protocol meanwhile
+        protocol = (await self._sessions.get(self.current_user)).snapshot()
 
         output_buffer, file_name, mime = BytesIO(), "", ""
         if action == "save":
@@ -142,18 +159,18 @@ class ProjectHandler(BaseRequestHandler):
             mime = "application/json"
 
         elif action == "generate_firmware":
-            file_name, mime = self._generate_firmware(protocol, output_buffer)
+            file_name, mime = await self._generate_firmware(protocol, output_buffer)
         elif action == "generate_documentation":
-            file_name, mime = self._generate_doc(protocol, output_buffer)
+            file_name, mime = await self._generate_doc(protocol, output_buffer)
         elif action == "generate_library":
-            clib.build(protocol, output_buffer)
+            await self._build(output_buffer, clib.build, protocol)
             file_name = "{}.zip".format(_normalize_target_name(protocol, "client"))
             mime = "application/zip"
 
         elif action == "generate_abstract_device":
             is_namespaced = self.get_query_argument("is_namespaced", "False") == "True"
 
-            device.build_full(protocol, output_buffer, is_namespaced=is_namespaced)
+            await self._build(output_buffer, device.build_full, protocol, is_namespaced=is_namespaced)
             if is_namespaced:
                 file_name = "{}.zip".format(_normalize_target_name(protocol, "abstract_device"))
             else:
@@ -161,17 +178,17 @@ class ProjectHandler(BaseRequestHandler):
             mime = "application/zip"
 
         elif action == "generate_tango":
-            tango.build(protocol, output_buffer)
+            await self._build(output_buffer, tango.build, protocol)
             file_name = "{}.zip".format(_normalize_target_name(protocol, "tango"))
             mime = "application/zip"
 
         elif action == "generate_debugger":
-            debugger.build(protocol, output_buffer)
+            await self._build(output_buffer, debugger.build, protocol)
             file_name = "{}.zip".format(_normalize_target_name(protocol, "debugger"))
             mime = "application/zip"
 
         elif action == "generate_bindings":
-            file_name, mime = self._generate_bind(protocol, output_buffer)
+            file_name, mime = await self._generate_bind(protocol, output_buffer)
 
         else:
             raise HTTPError(404)
@@ -187,7 +204,7 @@ class ProjectHandler(BaseRequestHandler):
         self.set_header("Content-Type", mime)
         self.set_header("Content-Disposition", 'attachment; filename="' + file_name + '"')
 
-    def post(self, action):
+    async def post(self, action):
         if action == "load":
             if not self.request.files:
                 EditorHandler.messages["load-message"] = "No input file"
@@ -198,16 +215,16 @@ class ProjectHandler(BaseRequestHandler):
             content = BytesIO(file_info["body"])
             protocol = (self._json_storage if ext == ".json" else self._oldxi_storage).load(content)
 
-            self._sessions[self.current_user] = protocol
+            await self._sessions.set(self.current_user, protocol)
 
             self.redirect(url_concat(self.reverse_url("editor"), {"action": "view", "handle": protocol.uid}))
 
         elif action == "assembly_profiles":
-            protocol = self._sessions[self.current_user]
+            protocol = (await self._sessions.get(self.current_user)).snapshot()
             output_buffer, file_name, mime = BytesIO(), "", ""
             profiles_list = self._assembly_profiles_list(protocol)
 
-            profiles.build(protocol, profiles_list, output_buffer, is_namespaced=True)
+            await self._build(output_buffer, _build_profiles, protocol, profiles_list)
 
             file_name = "{}.zip".format(_normalize_target_name(protocol, "profiles"))
             mime = "application/zip"
@@ -224,14 +241,14 @@ class ProjectHandler(BaseRequestHandler):
             self.set_header("Content-Disposition", 'attachment; filename="' + file_name + '"')
 
         elif ((action == "ximcstyle_assembly_profiles") or (action == "urmcstyle_assembly_profiles")):
-            protocol = self._sessions[self.current_user]
+            protocol = (await self._sessions.get(self.current_user)).snapshot()
             output_buffer, file_name, mime = BytesIO(), "", ""
             profiles_list = self._assembly_profiles_list(protocol)
 
             if action == "ximcstyle_assembly_profiles":
-                pythonprofiles.style_build(protocol, profiles_list, output_buffer, is_namespaced=True, style="ximc")
+                await self._build(output_buffer, _build_style_profiles, protocol, profiles_list, "ximc")
             elif action == "urmcstyle_assembly_profiles":
-                pythonprofiles.style_build(protocol, profiles_list, output_buffer, is_namespaced=True)
+                await self._build(output_buffer, _build_style_profiles, protocol, profiles_list, "urmc")
 
             file_name = "{}.zip".format(_normalize_target_name(protocol, "profiles"))
             mime = "application/zip"
@@ -248,11 +265,11 @@ class ProjectHandler(BaseRequestHandler):
             self.set_header("Content-Disposition", 'attachment; filename="' + file_name + '"')
 
         elif action == "remove_service_commands":
-            self._remove_service_commands()
+            await self._remove_service_commands()
 
             self.redirect(url_concat(self.reverse_url("editor"), {
                 "action": "view",
-                "handle": self._sessions[self.current_user].uid
+                "handle": (await self._sessions.get(self.current_user)).uid
                 }))
 
         else:
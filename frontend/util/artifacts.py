@@ -0,0 +1,127 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from os import getpid, listdir, makedirs, remove, replace, stat, utime
+from os.path import join
+from tempfile import gettempdir
+
+try:
+    import settings
+except ImportError:
+    settings = None
+
+# generated files held in RAM and on disk, in bytes
+default_memory_budget = getattr(settings, "artifact_memory_budget", 64 * 1024 * 1024)
+default_disk_budget = getattr(settings, "artifact_disk_budget", 1024 * 1024 * 1024)
+default_directory = getattr(settings, "artifact_dir", None) or join(
+    getattr(settings, "temp_dir", None) or gettempdir(), "urpc_artifacts"
+)
+
+
+class ArtifactCache:
+    """
+    Generated files by their content address, see BuildPool.tag(). Files used recently are held in RAM, the rest
+    are kept in a directory until they take the disk budget, the least recently used go first. The directory may be
+    shared by processes: files are written once under their address and never change.
+
+    Files are read from and written to the disk by the executor, off the event loop.
+    """
+
+    # the directory is looked through for files over the disk budget once this part of the budget is written
+    _sweep_part = 0.125
+
+    def __init__(self, memory_budget=None, disk_budget=None, directory=None, executor=None):
+        self._memory_budget = default_memory_budget if memory_budget is None else memory_budget
+        self._disk_budget = default_disk_budget if disk_budget is None else disk_budget
+        self._directory = directory or default_directory
+        self._executor = executor
+        # least recently used first
+        self._cache = OrderedDict()
+        self._written = 0
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        makedirs(self._directory, exist_ok=True)
+
+    def _path(self, key):
+        return join(self._directory, key)
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # the file is the most recently used one now
+            utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def _write(self, key, data, sweep):
+        path = self._path(key)
+        # other processes may write the same file meanwhile, it is the same file
+        with open("{}.{}.tmp".format(path, getpid()), "wb") as f:
+            f.write(data)
+        replace(f.name, path)
+        if sweep:
+            self._sweep()
+
+    def _sweep(self):
+        files = []
+        for name in listdir(self._directory):
+            # files being written by other processes are left
+            if name.endswith(".tmp"):
+                continue
+            try:
+                info = stat(self._path(name))
+            except FileNotFoundError:
+                continue
+            files.append((info.st_mtime, info.st_size, name))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, name in sorted(files):
+            if size <= self._disk_budget:
+                break
+            try:
+                remove(self._path(name))
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def _remember(self, key, data):
+        self._cache[key] = data
+        self.memory += len(data)
+        while self.memory > self._memory_budget and self._cache:
+            _, evicted = self._cache.popitem(last=False)
+            self.memory -= len(evicted)
+
+    async def get(self, key):
+        """
+        Returns the file or None if it isn't cached.
+        """
+        data = self._cache.get(key)
+        if data is None:
+            data = await asyncio.get_event_loop().run_in_executor(self._executor, self._read, key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._remember(key, data)
+        else:
+            self._cache.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if key in self._cache:
+            return
+        self._remember(key, data)
+        self._written += len(data)
+        sweep = self._written > self._disk_budget * self._sweep_part
+        if sweep:
+            self._written = 0
+        future = asyncio.get_event_loop().run_in_executor(self._executor, self._write, key, data, sweep)
+        future.add_done_callback(self._report)
+
+    @staticmethod
+    def _report(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error("Failed to store a generated file", exc_info=future.exception())
@@ -1,78 +1,354 @@
-from collections import Container
-from os import access, R_OK
-from os.path import join, isfile
+import asyncio
+import logging
+from collections import Container, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from os.path import join
 from uuid import UUID
 from tempfile import gettempdir
 
 from tornado.ioloop import IOLoop
 
+from frontend.util.store import FileStore, SqliteStore, StoreConflict
 from urpc.ast import Protocol
-from urpc.storage.json import JsonStorage
+from urpc.storage.binary import BinaryStorage
+from urpc.storage.journal import Journal, digest, replay
 
 try:
-    from settings import temp_dir
+    import settings
 except ImportError:
-    temp_dir = gettempdir()
+    settings = None
+
+temp_dir = getattr(settings, "temp_dir", None) or gettempdir()
+# estimated memory taken by projects held in RAM and the number of them
+default_memory_budget = getattr(settings, "session_memory_budget", 1024 * 1024 * 1024)
+default_max_sessions = getattr(settings, "max_sessions", 100)
+
+
+def _default_store():
+    # projects shared by several processes have to be kept in a database
+    if getattr(settings, "session_store", "file") == "sqlite":
+        return SqliteStore(getattr(settings, "session_db", None) or join(temp_dir, "sessions.sqlite3"))
+    return FileStore(temp_dir)
 
 
 class CachedItem:
-    def __init__(self, timeout, project):
-        self.timeout = timeout
-        self.project = project
+    def __init__(self):
+        self.project = None
+        # journal file of the project, see SessionStore
+        self.file = None
+        self.snapshot_size = 0
+        # estimated memory taken by the project
+        self.size = 0
+        self.last_access = 0
+        # make -> object made of the project, see SessionManager.derived()
+        self.derived = {}
 
 
 class SessionManager(Container):
-    # after 3 minutes without access project is removed from RAM cache and is dumped to disk
+    """
+    Projects are stored as a binary snapshot and a journal of changes made since then, see Journal. Changes are
+    written as they are made, the journal is compacted into a new snapshot once it outgrows the snapshot. Where
+    they are stored is up to the store, see SessionStore. A project changed by another process sharing the store
+    is loaded anew.
+
+    Projects are held in RAM until they aren't accessed for a while or until projects used more recently take
+    the memory budget or the number of sessions allowed. hits, misses and evictions count accesses to projects held
+    in RAM, the other accesses and projects removed from RAM.
+
+    Projects are loaded, snapshots are written and projects shared with other processes are checked for changes
+    by the executor, off the event loop, so get() and set() are coroutines. Loads and writes of a project are done
+    one at a time in the order they are started, concurrent requests of a project being loaded wait for the same
+    load.
+    """
+
+    # after 3 minutes without access project is removed from RAM cache
     _dump_timeout = 3 * 60
+    # journals of small projects aren't compacted until they take this many bytes
+    _min_journal_size = 64 * 1024
+    # loaded project takes up to this many times its snapshot size in RAM, lazily loaded one takes less
+    _size_ratio = 24
+    # projects over the limits are evicted until they are this much of the limits, so evictions come in batches
+    _low_watermark = 0.8
 
-    def __init__(self):
-        self._storage = JsonStorage()
+    def __init__(self, memory_budget=None, max_sessions=None, executor=None, store=None):
+        self._storage = BinaryStorage()
+        self._backend = _default_store() if store is None else store
         self._loop = IOLoop.current()
-        self._cache = {}
+        self._executor = executor or ThreadPoolExecutor(2)
+        self._memory_budget = default_memory_budget if memory_budget is None else memory_budget
+        self._max_sessions = default_max_sessions if max_sessions is None else max_sessions
+        # least recently used first
+        self._cache = OrderedDict()
+        # uid -> load of the project shared by requests of it
+        self._loading = {}
+        # uid -> the last load or write of the project started
+        self._pending = {}
+        # idle projects are looked for by a single timeout
+        self._sweep = None
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    def _path_from_uid(self, uid):
-        file_name = str(uid) + ".json"
-        file_path = join(temp_dir, file_name)
-        return file_path
+    @staticmethod
+    def _close_journal(project):
+        if project.journal is not None:
+            project.journal.close()
+            project.journal = None
 
-    def __getitem__(self, uid):
-        assert isinstance(uid, UUID)
-        item = self._cache.setdefault(uid, CachedItem(None, None))
-        if item.timeout:
-            self._loop.remove_timeout(item.timeout)
-
-        if not item.project:
-            path = self._path_from_uid(uid)
-            if isfile(path) and access(path, R_OK):
-                with open(path, "rb") as f:
-                    item.project = self._storage.load(f)
+    # Runs job(*args) in the executor once the former load or write of the project is done, returns its future
+    def _schedule(self, uid, job, *args):
+        previous = self._pending.get(uid)
+
+        async def run():
+            if previous is not None:
+                # a failure is reported to the ones waiting for the previous job
+                await asyncio.wait([previous])
+            return await asyncio.wrap_future(self._executor.submit(job, *args))
+
+        future = asyncio.ensure_future(run())
+        self._pending[uid] = future
+
+        def done(_):
+            if self._pending.get(uid) is future:
+                del self._pending[uid]
+        future.add_done_callback(done)
+        return future
+
+    # logs failure of a write nobody waits for
+    @staticmethod
+    def _report(future):
+        def done(_):
+            if not future.cancelled() and future.exception() is not None:
+                logging.error("Failed to store a project", exc_info=future.exception())
+        future.add_done_callback(done)
+
+    # writes a snapshot of the protocol, returns the empty journal file continuing it and the snapshot size
+    def _write_snapshot(self, uid, protocol, replaces=None):
+        snapshot = BytesIO()
+        # messages of accessors and repeated flag sets are stored once
+        self._storage.save(protocol, snapshot, dedupe=True)
+        snapshot = snapshot.getvalue()
+        return self._backend.save(uid, snapshot, digest(snapshot), replaces), len(snapshot)
+
+    # saves a snapshot of a project nothing else uses yet and starts an empty journal continuing it
+    def _save(self, uid, item):
+        item.file, item.snapshot_size = self._write_snapshot(uid, item.project)
+        item.project.journal = Journal(item.file)
+
+    def _store(self, uid, item):
+        """
+        Saves a snapshot of the project in use by the executor. Changes made meanwhile are kept by a new journal,
+        it is started once the snapshot is written. Returns future of the write.
+        """
+        snapshot = item.project.snapshot()
+        self._close_journal(item.project)
+        journal = item.project.journal = Journal()
+        # a project replaced by set() overwrites the stored one, otherwise the stored one must be the one loaded
+        future = self._schedule(uid, self._write_snapshot, uid, snapshot, item.file)
+
+        def done(_):
+            try:
+                file, snapshot_size = future.result()
+            except Exception:
+                # the project is saved anew or loaded anew on the next access
+                journal.failed = True
+                return
+            # the project may have been replaced meanwhile
+            if item.project.journal is not journal:
+                file.close()
+                return
+            item.file, item.snapshot_size = file, snapshot_size
+            try:
+                journal.start(file)
+            except (OSError, ValueError):
+                journal.failed = True
+            if self._cache.get(uid) is item:
+                self._resize(uid, item)
+        future.add_done_callback(done)
+        return future
+
+    def _needs_compaction(self, item):
+        journal = item.project.journal
+        return journal.failed or journal.size > max(item.snapshot_size, self._min_journal_size)
+
+    def _load_stored(self, uid, item):
+        stored = self._backend.load(uid)
+        if stored is None:
+            return False
+        snapshot, journal = stored
+        # only the commands list is decoded, the rest is decoded on demand
+        with snapshot:
+            item.project = self._storage.load(snapshot, lazy=True)
+            snapshot.seek(0)
+            data = snapshot.read()
+        base, item.snapshot_size = digest(data), len(data)
+        end = None if journal is None else replay(item.project, journal, base)
+        item.file = self._backend.resume(uid, base, end)
+        item.project.journal = Journal(item.file)
+        return True
+
+    # runs in the executor
+    def _load(self, uid):
+        item = CachedItem()
+        while True:
+            try:
+                if not self._load_stored(uid, item):
+                    item.project = Protocol(name="default_project", version="0.0.1")
+                    self._save(uid, item)
+                return item
+            except StoreConflict:
+                # written by another process while it was loaded
+                continue
+
+    def _start_loading(self, uid):
+        loading = self._loading[uid] = self._schedule(uid, self._load, uid)
+
+        def done(_):
+            del self._loading[uid]
+            if loading.cancelled() or loading.exception() is not None:
+                return
+            item = loading.result()
+            if uid in self._cache:
+                # the project was replaced while it was loaded
+                self._close_journal(item.project)
             else:
-                item.project = Protocol(name="default_project", version="0.0.1")
+                self._cache[uid] = item
+        loading.add_done_callback(done)
+        return loading
 
-        item.timeout = self._loop.call_later(self._dump_timeout, self._dump_cached, uid)
+    async def get(self, uid):
+        """
+        Returns project of the session, loads it or creates a new one if it isn't held in RAM.
+        """
+        assert isinstance(uid, UUID)
+        item = self._cache.get(uid)
+        if item is not None and uid not in self._pending and self._backend.shared:
+            changed = await asyncio.wrap_future(self._executor.submit(self._changed, uid, item))
+            # the project may have been replaced or removed from RAM meanwhile
+            if changed and self._cache.get(uid) is item:
+                self._discard(uid)
+            item = self._cache.get(uid)
+        if item is not None:
+            self.hits += 1
+            self._cache.move_to_end(uid)
+        else:
+            self.misses += 1
+            while item is None:
+                loading = self._loading.get(uid)
+                await (loading if loading is not None else self._start_loading(uid))
+                item = self._cache.get(uid)
+
+        self._accessed(uid, item)
+        if uid not in self._pending and self._needs_compaction(item):
+            self._report(self._store(uid, item))
         return item.project
 
-    def __setitem__(self, uid, project):
+    def derived(self, uid, make):
+        """
+        Returns make(project) for the project of the session got last, the object is made once and dropped along
+        with the project when it is removed from RAM or replaced.
+        """
+        item = self._cache[uid]
+        value = item.derived.get(make)
+        if value is None:
+            value = item.derived[make] = make(item.project)
+        return value
+
+    async def set(self, uid, project):
+        """
+        Replaces project of the session, returns once the project is stored.
+        """
         assert isinstance(uid, UUID) and isinstance(project, Protocol)
-        item = self._cache.setdefault(uid, CachedItem(None, None))
-        if item.timeout:
-            self._loop.remove_timeout(item.timeout)
+        old = self._cache.pop(uid, None)
+        if old is not None:
+            self.memory -= old.size
+            self._close_when_stored(uid, old.project)
+        item = CachedItem()
         item.project = project
-        item.timeout = self._loop.call_later(self._dump_timeout, self._dump_cached, uid)
+        self._cache[uid] = item
+        stored = self._store(uid, item)
+        self._accessed(uid, item)
+        await stored
+
+    async def close(self):
+        """
+        Waits for projects being stored and removes projects from RAM, changes made afterwards aren't stored.
+        """
+        while self._pending:
+            await asyncio.wait(list(self._pending.values()))
+        if self._sweep is not None:
+            self._loop.remove_timeout(self._sweep)
+            self._sweep = None
+        for uid in list(self._cache):
+            self._discard(uid)
+        await asyncio.wrap_future(self._executor.submit(self._backend.close))
 
     def __contains__(self, uid):
         assert isinstance(uid, UUID)
-        if uid in self._cache:
-            return True
+        return uid in self._cache or uid in self._backend
+
+    # runs in the executor
+    def _changed(self, uid, item):
+        return item.file is not None and self._backend.changed(uid, item.file)
+
+    # drops the project changed by another process, changes this process failed to store are lost
+    def _discard(self, uid):
+        item = self._cache.pop(uid)
+        self.memory -= item.size
+        self._close_journal(item.project)
+
+    def _accessed(self, uid, item):
+        item.last_access = self._loop.time()
+        self._resize(uid, item)
+        if self._sweep is None:
+            self._schedule_sweep()
+
+    def _resize(self, uid, item):
+        size = self._size_ratio * (item.snapshot_size + item.project.journal.size)
+        self.memory += size - item.size
+        item.size = size
+        if self.memory > self._memory_budget or len(self._cache) > self._max_sessions:
+            self._evict_least_recent(keep=uid)
+
+    # closes the journal once the snapshot it continues is written, changes kept by the journal are lost otherwise
+    def _close_when_stored(self, uid, project):
+        pending = self._pending.get(uid)
+        if pending is None:
+            self._close_journal(project)
         else:
-            file_name = str(uid) + ".json"
-            file_path = join(temp_dir, file_name)
-            return isfile(file_path) and access(file_path, R_OK)
+            pending.add_done_callback(lambda _: self._close_journal(project))
 
-    def _dump_cached(self, uid):
-        assert isinstance(uid, UUID)
+    def _evict(self, uid):
         item = self._cache.pop(uid)
-        self._loop.remove_timeout(item.timeout)
-        path = self._path_from_uid(uid)
-        with open(path, "wb") as f:
-            self._storage.save(item.project, f)
+        self.memory -= item.size
+        self.evictions += 1
+        # changes are in the journal already, it is only compacted if it has outgrown the snapshot
+        if uid not in self._pending and self._needs_compaction(item):
+            self._report(self._store(uid, item))
+        self._close_when_stored(uid, item.project)
+
+    def _evict_least_recent(self, keep):
+        memory = self._memory_budget * self._low_watermark
+        count = self._max_sessions * self._low_watermark
+        for uid in list(self._cache):
+            if self.memory <= memory and len(self._cache) <= count:
+                break
+            # the project in use stays even if it alone is over the budget
+            if uid != keep:
+                self._evict(uid)
+
+    def _schedule_sweep(self):
+        if self._cache:
+            oldest = next(iter(self._cache.values()))
+            self._sweep = self._loop.call_at(oldest.last_access + self._dump_timeout, self._sweep_idle)
+
+    def _sweep_idle(self):
+        self._sweep = None
+        deadline = self._loop.time() - self._dump_timeout
+        for uid, item in list(self._cache.items()):
+            if item.last_access > deadline:
+                break
+            self._evict(uid)
+        self._schedule_sweep()
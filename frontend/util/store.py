@@ -0,0 +1,338 @@
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from os import access, getpid, remove, replace, R_OK
+from os.path import join, isfile
+
+from urpc.storage.binary import BinaryStorage
+from urpc.storage.journal import header
+from urpc.storage.json import JsonStorage
+
+
+class StoreConflict(ValueError):
+    """
+    The project was changed by another process meanwhile.
+    """
+
+
+class SessionStore(ABC):
+    """
+    Keeps projects of sessions as a binary snapshot and a journal of changes made since then, see SessionManager.
+    Journals are written through file-like objects given by the store, on the event loop. The rest of methods may
+    block and are called by the executor.
+    """
+
+    # projects may be changed by other processes, changed() is only called if so
+    shared = False
+
+    @abstractmethod
+    def __contains__(self, uid):
+        pass
+
+    @abstractmethod
+    def load(self, uid):
+        """
+        Returns a binary file of the snapshot and the journal data, None if there's no journal, or None if there's
+        no project.
+        """
+
+    @abstractmethod
+    def save(self, uid, snapshot, base, replaces=None):
+        """
+        Replaces the project with the snapshot having the given digest, returns an empty journal file continuing it.
+        If the journal file the project was stored by is given, StoreConflict is raised if the project has been
+        changed by another process since.
+        """
+
+    @abstractmethod
+    def resume(self, uid, base, end):
+        """
+        Returns the journal file of the project loaded continued from the end, see replay(). A new journal is
+        started if the end is None.
+        """
+
+    def changed(self, uid, file):
+        """
+        Tells if the project stored by the journal file has been changed by another process, called on every access
+        to the project.
+        """
+        return False
+
+    def close(self):
+        """
+        Waits for journals being written.
+        """
+
+
+class FileStore(SessionStore):
+    """
+    Files in the directory, projects must be used by a single process.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._storage = BinaryStorage()
+        # projects dumped before the binary format are still read
+        self._legacy_storage = JsonStorage()
+
+    def _path_from_uid(self, uid, extension=".urpb"):
+        file_name = str(uid) + extension
+        file_path = join(self._directory, file_name)
+        return file_path
+
+    def __contains__(self, uid):
+        return any(
+            isfile(path) and access(path, R_OK)
+            for path in (self._path_from_uid(uid, ".urpb"), self._path_from_uid(uid, ".json"))
+        )
+
+    def _write_snapshot(self, uid, snapshot):
+        path = self._path_from_uid(uid)
+        # lazily loaded project may still be mapped from the former snapshot, so it is replaced instead of overwritten
+        with open(path + ".tmp", "wb") as f:
+            f.write(snapshot)
+        replace(path + ".tmp", path)
+
+    def load(self, uid):
+        path = self._path_from_uid(uid)
+        legacy_path = self._path_from_uid(uid, ".json")
+        if not (isfile(path) and access(path, R_OK)):
+            if not (isfile(legacy_path) and access(legacy_path, R_OK)):
+                return None
+            with open(legacy_path, "rb") as f:
+                protocol = self._legacy_storage.load(f)
+            snapshot = BytesIO()
+            self._storage.save(protocol, snapshot, dedupe=True)
+            self._write_snapshot(uid, snapshot.getvalue())
+            remove(legacy_path)
+
+        journal = None
+        journal_path = self._path_from_uid(uid, ".journal")
+        if isfile(journal_path):
+            with open(journal_path, "rb") as f:
+                journal = f.read()
+        return open(path, "rb"), journal
+
+    def save(self, uid, snapshot, base, replaces=None):
+        self._write_snapshot(uid, snapshot)
+        # the former journal is left if this is interrupted, it doesn't match the new snapshot and is dropped
+        return self.resume(uid, base, None)
+
+    def resume(self, uid, base, end):
+        path = self._path_from_uid(uid, ".journal")
+        if end is None:
+            file = open(path, "wb")
+            try:
+                file.write(header(base))
+                file.flush()
+            except OSError:
+                file.close()
+                raise
+        else:
+            # anything after the end is dropped
+            file = open(path, "r+b")
+            file.truncate(end)
+            file.seek(end)
+        return file
+
+
+class _JournalRows:
+    """
+    Journal file of SqliteStore. Writes are buffered and stored as rows by the writer thread of the store, writes
+    made meanwhile are stored at once. Rows are appended if the project wasn't changed by another process, otherwise
+    the file is in conflict and the rest of writes fail.
+    """
+
+    def __init__(self, store, uid, generation, seq, size):
+        self._store = store
+        self._uid = uid
+        self.generation = generation
+        self.seq = seq
+        self._size = size
+        self.closed = False
+        self.conflict = False
+        self.failed = False
+        # writes not stored yet, a flush is scheduled while there are some
+        self._rows = []
+        self._flushing = False
+        self._buffer_lock = threading.Lock()
+        # taken while the rows stored and the project row are compared or changed
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("Journal is closed")
+        if self.conflict:
+            raise StoreConflict("Project was changed by another process")
+        if self.failed:
+            raise OSError("Journal rows couldn't be written")
+        with self._buffer_lock:
+            self._rows.append(data)
+        self._size += len(data)
+
+    def flush(self):
+        with self._buffer_lock:
+            if self._flushing or not self._rows:
+                return
+            self._flushing = True
+        self._store._writer.submit(self._commit)
+
+    # runs in the writer thread
+    def _commit(self):
+        with self._buffer_lock:
+            rows, self._rows = self._rows, []
+            self._flushing = False
+        with self.lock:
+            if self.conflict or self.failed:
+                return
+            try:
+                with self._store._transaction() as db:
+                    cursor = db.execute(
+                        "UPDATE sessions SET seq = seq + ? WHERE uid = ? AND generation = ? AND seq = ?",
+                        (len(rows), self._uid, self.generation, self.seq)
+                    )
+                    if cursor.rowcount == 0:
+                        self.conflict = True
+                        return
+                    db.executemany(
+                        "INSERT INTO journal (uid, seq, data) VALUES (?, ?, ?)",
+                        ((self._uid, self.seq + i, data) for i, data in enumerate(rows))
+                    )
+            except sqlite3.Error:
+                # the project is saved anew on the next write
+                logging.error("Failed to store a journal", exc_info=True)
+                self.failed = True
+                return
+            self.seq += len(rows)
+
+    def tell(self):
+        return self._size
+
+    def close(self):
+        # writes buffered are still stored
+        self.flush()
+        self.closed = True
+
+
+class SqliteStore(SessionStore):
+    """
+    SQLite database in WAL mode, projects may be shared by processes. The row of a project in the sessions table
+    counts its snapshots (generation) and journal rows (seq): a snapshot or a journal row is only written if they
+    are the ones the process has seen, so a project changed by several processes at once keeps the changes made
+    first, the rest of processes reload it. Connections are kept for every thread of every process.
+
+    Journal rows are written by a thread of the store, so edits don't wait for the database. Writes of a crashed
+    process which weren't stored yet are lost.
+    """
+
+    shared = True
+
+    # waiting for locks held by other processes, in seconds
+    _timeout = 30
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        self._writer = ThreadPoolExecutor(1)
+        with self._transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "uid TEXT PRIMARY KEY, snapshot BLOB NOT NULL, base BLOB NOT NULL, "
+                "generation INTEGER NOT NULL, seq INTEGER NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS journal ("
+                "uid TEXT NOT NULL, seq INTEGER NOT NULL, data BLOB NOT NULL, PRIMARY KEY (uid, seq))"
+            )
+
+    def _connection(self):
+        local = self._local
+        # connections can't be shared with forked processes
+        if getattr(local, "pid", None) != getpid():
+            local.db = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None)
+            local.db.execute("PRAGMA journal_mode = WAL")
+            local.db.execute("PRAGMA synchronous = NORMAL")
+            local.pid = getpid()
+        return local.db
+
+    def _transaction(self, mode="IMMEDIATE"):
+        return _Transaction(self._connection(), mode)
+
+    def __contains__(self, uid):
+        row = self._connection().execute("SELECT 1 FROM sessions WHERE uid = ?", (str(uid),)).fetchone()
+        return row is not None
+
+    def load(self, uid):
+        # the snapshot and the journal are read at once, writers don't wait for readers in WAL mode
+        with self._transaction("DEFERRED") as db:
+            row = db.execute("SELECT snapshot FROM sessions WHERE uid = ?", (str(uid),)).fetchone()
+            if row is None:
+                return None
+            rows = db.execute("SELECT data FROM journal WHERE uid = ? ORDER BY seq", (str(uid),))
+            journal = b"".join(data for data, in rows)
+        return BytesIO(row[0]), journal
+
+    def save(self, uid, snapshot, base, replaces=None):
+        if replaces is None:
+            return self._save(uid, snapshot, base, None)
+        # rows of the replaced journal aren't stored meanwhile, the ones left are in the snapshot and conflict
+        with replaces.lock:
+            return self._save(uid, snapshot, base, replaces)
+
+    def _save(self, uid, snapshot, base, replaces):
+        start = header(base)
+        with self._transaction() as db:
+            row = db.execute("SELECT generation, seq FROM sessions WHERE uid = ?", (str(uid),)).fetchone()
+            if replaces is not None and (replaces.conflict or row != (replaces.generation, replaces.seq)):
+                raise StoreConflict("Project was changed by another process")
+            generation = 0 if row is None else row[0] + 1
+            db.execute("DELETE FROM journal WHERE uid = ?", (str(uid),))
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (uid, snapshot, base, generation, seq) VALUES (?, ?, ?, ?, 1)",
+                (str(uid), snapshot, base, generation)
+            )
+            db.execute("INSERT INTO journal (uid, seq, data) VALUES (?, 0, ?)", (str(uid), start))
+        return _JournalRows(self, str(uid), generation, 1, len(start))
+
+    def resume(self, uid, base, end):
+        with self._transaction("DEFERRED") as db:
+            row = db.execute(
+                "SELECT generation, seq, (SELECT total(length(data)) FROM journal WHERE uid = ?) "
+                "FROM sessions WHERE uid = ? AND base = ?",
+                (str(uid), str(uid), base)
+            ).fetchone()
+        # rows are written whole, so the journal may only differ from the one loaded if it was written meanwhile
+        if row is None or end != row[2]:
+            raise StoreConflict("Project was changed by another process")
+        return _JournalRows(self, str(uid), row[0], row[1], end)
+
+    def changed(self, uid, file):
+        with file.lock:
+            row = self._connection().execute(
+                "SELECT generation, seq FROM sessions WHERE uid = ?", (str(uid),)
+            ).fetchone()
+            return file.conflict or row != (file.generation, file.seq)
+
+    def close(self):
+        self._writer.shutdown()
+
+
+class _Transaction:
+    """
+    Writes are serialized by the database, so writing transactions are IMMEDIATE: they take the write lock at once
+    instead of upgrading a read lock, which fails if another process writes meanwhile.
+    """
+
+    def __init__(self, db, mode):
+        self._db = db
+        self._mode = mode
+
+    def __enter__(self):
+        self._db.execute("BEGIN " + self._mode)
+        return self._db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._db.execute("COMMIT" if exc_type is None else "ROLLBACK")
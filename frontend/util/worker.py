@@ -1,6 +1,149 @@
+import asyncio
 from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from hashlib import blake2b
+from io import BytesIO
+from weakref import WeakKeyDictionary
 
-# This is useless list
-# but it is required for avoiding
-# flake8 messages about unused modules
-_modules_to_be_used_by_parents = [ProcessPoolExecutor.__name__]
+from tornado.process import cpu_count
+from tornado.web import HTTPError
+
+from frontend.util.artifacts import ArtifactCache
+from urpc.storage.binary import BinaryStorage
+from version import BUILDER_VERSION
+
+try:
+    import settings
+except ImportError:
+    settings = None
+
+# processes generating projects, jobs submitted and not done yet and seconds a request waits for its job
+default_processes = getattr(settings, "build_processes", None) or cpu_count()
+default_max_queue = getattr(settings, "build_queue", None) or 4 * default_processes
+default_timeout = getattr(settings, "build_timeout", 120)
+
+
+# runs in a worker process
+def _build(build, snapshot, args, kwargs):
+    protocol = BinaryStorage().load(BytesIO(snapshot))
+    output = BytesIO()
+    build(protocol, output, *args, **kwargs)
+    return output.getvalue()
+
+
+class BuildPool:
+    """
+    Runs builders in worker processes, so generating a big project doesn't block the event loop. Builders are
+    module-level functions taking the protocol and the output first, the protocol is passed to them as a binary
+    snapshot.
+
+    Requests over the limit of jobs submitted get 503, requests waiting longer than the timeout get 504. A job
+    running past the timeout can't be stopped and takes its process until it is done, it is counted in the queue
+    until then.
+
+    Outputs are cached by their tag, requests of an output being built wait for the same job.
+    """
+
+    def __init__(self, processes=None, max_queue=None, timeout=None, cache=None):
+        self._executor = ProcessPoolExecutor(processes or default_processes)
+        self._max_queue = max_queue or default_max_queue
+        self._timeout = default_timeout if timeout is None else timeout
+        self._cache = ArtifactCache() if cache is None else cache
+        self._storage = BinaryStorage()
+        # snapshot -> future of the digest of its binary encoding, snapshots are kept by projects until they change
+        self._digests = WeakKeyDictionary()
+        # snapshot -> its binary encoding made by tag() until build() submits it or forget() is called
+        self._encodings = WeakKeyDictionary()
+        # tag -> job, its future and the number of requests waiting for it
+        self._jobs = {}
+        self.queued = 0
+
+    def _encode(self, protocol):
+        snapshot = BytesIO()
+        self._storage.save(protocol, snapshot, dedupe=True)
+        return snapshot.getvalue()
+
+    # runs in the executor
+    def _encode_digest(self, protocol):
+        snapshot = self._encode(protocol)
+        return snapshot, blake2b(snapshot, digest_size=16).digest()
+
+    async def _digest(self, protocol):
+        snapshot, digest = await asyncio.get_event_loop().run_in_executor(None, self._encode_digest, protocol)
+        self._encodings[protocol] = snapshot
+        return digest
+
+    async def tag(self, build, protocol, *args, **kwargs):
+        """
+        Content address of the output: digest of the protocol, the builder, its arguments and the builder version.
+        Structural fingerprints aren't enough, builders output descriptions and options too. The protocol is
+        encoded off the event loop once, its encoding is kept for build() until forget() is called.
+        """
+        digest = self._digests.get(protocol)
+        if digest is None:
+            digest = self._digests[protocol] = asyncio.ensure_future(self._digest(protocol))
+
+            # a failed encoding is tried anew by the next request
+            def done(future):
+                if future.cancelled() or future.exception() is not None:
+                    self._digests.pop(protocol, None)
+            digest.add_done_callback(done)
+        digest = await asyncio.shield(digest)
+        name = "{}.{}".format(build.__module__, getattr(build, "__qualname__", type(build).__qualname__))
+        key = repr((BUILDER_VERSION, name, digest, args, sorted(kwargs.items())))
+        return blake2b(key.encode(), digest_size=16).hexdigest()
+
+    def forget(self, protocol):
+        """
+        Drops the encoding of the protocol kept by tag(), for outputs which won't be built.
+        """
+        self._encodings.pop(protocol, None)
+
+    def _done(self, tag, job):
+        self.queued -= 1
+        del self._jobs[tag]
+        if not job.cancelled() and job.exception() is None:
+            self._cache.put(tag, job.result())
+
+    async def build(self, build, protocol, *args, **kwargs):
+        """
+        Returns the output of build(protocol, output, *args, **kwargs).
+        """
+        tag = await self.tag(build, protocol, *args, **kwargs)
+        snapshot = self._encodings.pop(protocol, None)
+        output = await self._cache.get(tag)
+        if output is not None:
+            return output
+
+        if tag not in self._jobs and snapshot is None:
+            snapshot = await asyncio.get_event_loop().run_in_executor(None, self._encode, protocol)
+        # the job may have been submitted meanwhile
+        if tag not in self._jobs:
+            if self.queued >= self._max_queue:
+                raise HTTPError(503, "Too many projects are being generated")
+            future = self._executor.submit(_build, build, snapshot, args, kwargs)
+            self.queued += 1
+            job = asyncio.wrap_future(future)
+            job.add_done_callback(partial(self._done, tag))
+            self._jobs[tag] = [job, future, 0]
+        entry = self._jobs[tag]
+        job, future = entry[0], entry[1]
+        entry[2] += 1
+        try:
+            # the job isn't cancelled by the timeout, so it is counted until it is done
+            return await asyncio.wait_for(asyncio.shield(job), self._timeout)
+        except asyncio.TimeoutError:
+            # a job still queued is dropped once no request waits for it
+            if entry[2] == 1:
+                future.cancel()
+            raise HTTPError(504, "Generation took longer than {} s".format(self._timeout))
+        except asyncio.CancelledError:
+            # the job was dropped by a request timed out before this one came
+            if job.cancelled():
+                raise HTTPError(504, "Generation took longer than {} s".format(self._timeout))
+            raise
+        finally:
+            entry[2] -= 1
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -1,12 +1,23 @@
 import asyncio
 import os
 import logging
+import signal
+import sys
+import time
 
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
 from tornado.platform.asyncio import AsyncIOMainLoop
+from tornado.process import cpu_count
 from tornado.web import Application, StaticFileHandler
 
 from frontend.handler import editor, generic, project
+from frontend.handler.base import BaseRequestHandler
+from frontend.util import artifacts, session
+from frontend.util.artifacts import ArtifactCache
 from frontend.util.session import SessionManager
+from frontend.util.worker import BuildPool, default_max_queue, default_processes
 
 try:
     import settings as Settings
@@ -14,16 +25,23 @@ except ImportError:
     class Settings:
         url_prefix = ""
         port = 8888
+        # number of server processes, 0 for one per core
+        workers = 1
+        # seconds stopping server waits for requests being handled
+        shutdown_timeout = 10
 
+# a worker crashed sooner than this many seconds after start is restarted after a delay, so crashes don't spin
+_min_uptime = 1
 
-def make_app():
+
+def make_app(debug=True, sessions=None, builds=None):
     current_dir = os.path.dirname(os.path.realpath(__file__))
     fronted_dir = os.path.join(current_dir, "frontend")
     static_dir = os.path.join(fronted_dir, "static")
 
     settings = {
         "app_root": current_dir,
-        "debug": True,
+        "debug": debug,
         "compress_response": True,
         "template_path": os.path.join(fronted_dir, "templates"),
         "static_path": static_dir,
@@ -32,25 +50,129 @@ def make_app():
         # "login_url": "/login"
     }
 
-    sessions = SessionManager()
+    if sessions is None:
+        sessions = SessionManager()
+    if builds is None:
+        builds = BuildPool()
 
     return Application((
         (Settings.url_prefix + r"/main$", generic.MainHandler, {"sessions": sessions}, "main"),
         (Settings.url_prefix + r"/help(?P<page>[a-z_]+)?$", generic.HelpHandler, {}, "help"),
         (Settings.url_prefix + r"/editor$", editor.EditorHandler, {"sessions": sessions}, "editor"),
         (Settings.url_prefix + r"/project/(?P<action>[a-z_]+)?$",
-         project.ProjectHandler, {"sessions": sessions}, "project"),
+         project.ProjectHandler, {"sessions": sessions, "builds": builds}, "project"),
         (Settings.url_prefix + r"/(?P<action>[a-z_]+)?$", generic.MainHandler, {"sessions": sessions}, "upload"),
         (Settings.url_prefix + r"/(favicon\.ico)", StaticFileHandler),
         (Settings.url_prefix + r"/(robots\.txt)", StaticFileHandler),
     ), **settings)
 
 
+def fork_workers(count):
+    """
+    Forks the workers and restarts the crashed ones. Returns number of the worker in worker processes, the supervisor
+    exits once all workers have exited. SIGTERM and SIGINT are passed to workers, which stop gracefully.
+    """
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            os.kill(pid, signal.SIGTERM)
+
+    def start(worker):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            return True
+        children[pid] = worker, time.monotonic()
+        return False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker in range(count):
+        if start(worker):
+            return worker
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in children:
+            continue
+        worker, started = children.pop(pid)
+        if stopping or (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0):
+            continue
+        logging.error("Worker {} exited with status {}, restarting...".format(worker, status))
+        if time.monotonic() - started < _min_uptime:
+            time.sleep(_min_uptime)
+        if not stopping and start(worker):
+            return worker
+    sys.exit(0)
+
+
+def serve(sockets, workers):
+    debug = getattr(Settings, "debug", workers == 1)
+    # projects held in RAM and generating processes are divided between workers
+    sessions = SessionManager(
+        memory_budget=session.default_memory_budget // workers,
+        max_sessions=max(1, session.default_max_sessions // workers)
+    )
+    builds = BuildPool(
+        processes=max(1, default_processes // workers),
+        max_queue=max(1, default_max_queue // workers),
+        # generated files on disk are shared by workers
+        cache=ArtifactCache(memory_budget=artifacts.default_memory_budget // workers)
+    )
+    # reloading on changes can't be done by forked processes
+    app = make_app(debug=debug and workers == 1, sessions=sessions, builds=builds)
+    server = HTTPServer(app, max_buffer_size=100 * 1024 * 1024)
+    server.add_sockets(sockets)
+    loop = IOLoop.current()
+    timeout = getattr(Settings, "shutdown_timeout", 10)
+    stopping = False
+
+    async def shutdown():
+        server.stop()
+        deadline = loop.time() + timeout
+        while BaseRequestHandler.active and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        await sessions.close()
+        builds.close()
+        loop.stop()
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            stopping = True
+            logging.info("Stopping server...")
+            loop.add_callback_from_signal(lambda: asyncio.ensure_future(shutdown()))
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    loop.start()
+
+
 if __name__ == "__main__":
-    AsyncIOMainLoop().install()
-    app = make_app()
+    workers = getattr(Settings, "workers", 1) or cpu_count()
+    if workers > 1:
+        # forked processes share projects through the database only
+        if getattr(Settings, "session_store", "file") != "sqlite":
+            raise ValueError("Several workers need session_store = \"sqlite\" in settings")
+        if not hasattr(os, "fork"):
+            raise ValueError("Several workers can't be run on this system")
 
     logging.basicConfig(level=logging.INFO)
     logging.info("Starting server on port {}...".format(Settings.port))
-    app.listen(Settings.port, max_buffer_size=100 * 1024 * 1024)
-    asyncio.get_event_loop().run_forever()
+    # workers accept connections of the same socket
+    sockets = bind_sockets(Settings.port)
+    worker = fork_workers(workers) if workers > 1 else 0
+    if workers > 1:
+        formatter = logging.Formatter("[worker {}] %(levelname)s:%(name)s:%(message)s".format(worker))
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(formatter)
+    AsyncIOMainLoop().install()
+    serve(sockets, workers)
@@ -0,0 +1,52 @@
+"""
+Times building, reordering and deleting the commands of a large protocol:
+
+    python -m tests.bench_children [commands]
+"""
+import sys
+from time import perf_counter
+
+from urpc import ast
+
+_digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _cid(i):
+    return "c" + _digits[i // 36 ** 2 % 36] + _digits[i // 36 % 36] + _digits[i % 36]
+
+
+def _timed(label, action):
+    start = perf_counter()
+    action()
+    print("{:<8} {:.3f} s".format(label, perf_counter() - start))
+
+
+def main(count=10000):
+    commands = [
+        ast.Command(_cid(i), "cmd{}".format(i), ast.Message([ast.Argument(ast.Integer32s, "Arg")]), ast.Message())
+        for i in range(count)
+    ]
+    protocol = ast.Protocol("bench", "1.0.0")
+
+    def build():
+        for command in commands:
+            protocol.commands.append(command)
+
+    def reorder():
+        # swaps every pair of neighbours
+        for i in range(0, count - 1, 2):
+            protocol.commands.insert(i, protocol.commands[i + 1])
+
+    def delete():
+        for command in commands:
+            protocol.commands.remove(command)
+
+    _timed("build", build)
+    _timed("reorder", reorder)
+    assert protocol.commands[0] is commands[1] and protocol.commands[1] is commands[0]
+    _timed("delete", delete)
+    assert not protocol.commands
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,61 @@
+"""
+Times loading a JSON project with the reference (marshmallow) decoder and the fast one:
+
+    python -m tests.bench_json [commands ...]
+
+Each command has 3 scalar arguments and one array argument with 2 flags.
+"""
+import sys
+from io import BytesIO
+from time import perf_counter
+
+from urpc import ast
+from urpc.storage.json import JsonStorage
+
+_digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _cid(i):
+    return "c" + _digits[i // 36 ** 2 % 36] + _digits[i // 36 % 36] + _digits[i % 36]
+
+
+def _protocol(count):
+    def args(prefix):
+        flags = [ast.FlagConstant("{}_FLAG{}".format(prefix.upper(), j), 1 << j) for j in range(2)]
+        return [
+            ast.Argument(ast.Integer8u, prefix + "A"),
+            ast.Argument(ast.Integer32s, prefix + "B"),
+            ast.Argument(ast.Float, prefix + "C"),
+            ast.Argument(ast.Array(ast.Integer16u, 8), prefix + "D", consts=flags),
+        ]
+
+    commands = [
+        ast.Command(_cid(i), "cmd{}".format(i), ast.Message(args("Cmd{}".format(i))), ast.Message())
+        for i in range(count)
+    ]
+    return ast.Protocol("bench", "1.0.0", commands)
+
+
+def _best(load, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        load()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def main(*counts):
+    storage = JsonStorage()
+    print("commands   reference   fast")
+    for count in counts or (100, 1000, 10000):
+        output = BytesIO()
+        storage.save(_protocol(count), output)
+        data = output.getvalue()
+        reference = _best(lambda: storage.load(BytesIO(data), reference=True))
+        fast = _best(lambda: storage.load(BytesIO(data)))
+        print("{:>8} {:>8.0f} ms {:>5.0f} ms".format(count, reference * 1000, fast * 1000))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
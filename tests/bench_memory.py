@@ -0,0 +1,43 @@
+"""
+Measures memory taken by the AST of a protocol with tracemalloc:
+
+    python -m tests.bench_memory [commands]
+
+Each command is made of 11 nodes: the command, its two messages, 5 arguments and 2 flag constants. Nodes have no
+descriptions.
+"""
+import gc
+import sys
+import tracemalloc
+
+from urpc import ast
+
+_digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _cid(i):
+    return "c" + _digits[i // 36 ** 2 % 36] + _digits[i // 36 % 36] + _digits[i % 36]
+
+
+def _protocol(count):
+    commands = []
+    for i in range(count):
+        request = ast.Message([ast.Argument(ast.Integer32u, "Arg{}".format(j)) for j in range(4)])
+        flags = [ast.FlagConstant("F{}".format(k), 1 << k) for k in range(2)]
+        response = ast.Message([ast.Argument(ast.Integer8u, "Flags", consts=flags)])
+        commands.append(ast.Command(_cid(i), "cmd{}".format(i), request, response))
+    return ast.Protocol("bench", "1.0.0", commands)
+
+
+def main(count=1000):
+    gc.collect()
+    tracemalloc.start()
+    protocol = _protocol(count)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("{} commands: {:.0f} KiB".format(len(protocol.commands), size / 1024))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,95 @@
+"""
+Times importing a generated .xi file, with the field tokenizer and with the pyparsing grammar alone:
+
+    python -m tests.bench_oldxi [commands]
+
+Commands have 1 to 8 fields of all kinds: plain, flagset, array, calibration and service answer ones, half of them
+described. Universal commands turn into two commands on import.
+"""
+import random
+import sys
+from io import BytesIO
+from time import perf_counter
+
+from urpc.storage.oldxi import OldxiStorage, command
+
+_types = ["int64s", "int64u", "int32s", "int32u", "int16u", "int16s", "int8u", "int8s", "float", "char", "byte",
+          "cfloat", "cdfloat"]
+
+
+def _field(rnd, index, flagsets):
+    type_str = rnd.choice(_types)
+    kind = rnd.random()
+    if kind < 0.15 and type_str.startswith("int"):
+        line = "{} flag Field{} of Flags{}".format(type_str, index, rnd.randrange(flagsets))
+    elif kind < 0.25:
+        line = "{} Arr{}[{}]".format(type_str, index, rnd.randint(1, 16))
+    elif kind < 0.3:
+        line = "calb float Cal{}".format(index)
+    elif kind < 0.33:
+        line = "{} serviceanswer Svc{}".format(type_str, index)
+    else:
+        line = "{} Field{}".format(type_str, index)
+    if rnd.random() < 0.5:
+        line += " /**< \\english Field {} \\endenglish \\russian Поле \\endrussian */".format(index)
+    return line
+
+
+def _xi(count, seed=1):
+    rnd = random.Random(seed)
+    flagsets = max(1, count // 50)
+    lines = ['protocol "v17.3"', "defaults with crc, answer", ""]
+    for f in range(flagsets):
+        lines += ["/**", " * \\english", " * Flagset {}".format(f), " * \\endenglish", " */"]
+        lines.append("flagset Flags{}:".format(f))
+        lines += ["FLAG_{}_{} = 0x{:02X}".format(f, m, 1 << m) for m in range(4)]
+        lines.append("")
+
+    cids = set()
+    for c in range(count):
+        while True:
+            cid = "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(3))
+            if c % 3:
+                cid = "c" + cid
+            if cid not in cids:
+                cids.add(cid)
+                break
+        lines += ["/** $XIR", " * \\english", " * Read {}".format(c), " * \\endenglish", " * \\russian", " * Чтение",
+                  " * \\endrussian", " */", "/** $XIW", " * \\english", " * Write {}".format(c), " * \\endenglish",
+                  " */"]
+        if c % 3 == 0:
+            lines.append('command "cmd_{}" universal "{}" (30)'.format(c, cid))
+        elif c % 3 == 1:
+            lines.append('command "cmd_{0}" writer "{1}" (30) reader "{1}" (30) with inline'.format(c, cid))
+        else:
+            lines.append('command "cmd_{}" reader "{}" (20)'.format(c, cid))
+        lines.append("fields:")
+        lines += [_field(rnd, a, flagsets) for a in range(rnd.randint(1, 8))]
+        if c % 3 == 0 and rnd.random() < 0.3:
+            lines.append("reserved {}".format(rnd.randint(1, 20)))
+        if c % 3 == 1:
+            lines += ["answer:", "int32s Result /**< \\english result \\endenglish */"]
+        lines.append("")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _timed(label, data):
+    start = perf_counter()
+    protocol = OldxiStorage().load(BytesIO(data))
+    print("{:<10} {:.2f} s, {} commands".format(label, perf_counter() - start, len(protocol.commands)))
+
+
+def main(count=3000):
+    data = _xi(count)
+    _timed("tokenizer", data)
+    scan_field = command._scan_field
+    # the tokenizer gives up on every field, so they are all parsed by the grammar
+    command._scan_field = lambda s, loc: None
+    try:
+        _timed("grammar", data)
+    finally:
+        command._scan_field = scan_field
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,13 @@
+from urpc import ast
+from urpc.storage.batch import convert
+from urpc.storage.json import JsonStorage
+
+
+def test_duplicated_source(tmp_path):
+    source = str(tmp_path / "project.json")
+    with open(source, "wb") as output:
+        JsonStorage().save(ast.Protocol("test", "1.0.0"), output)
+
+    results = list(convert([source, source], str(tmp_path / "out"), "binary", jobs=1))
+    assert results[0].error is None
+    assert results[1].error.startswith("target ")
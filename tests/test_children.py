@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from urpc import ast
+
+
+def _message(count):
+    return ast.Message([ast.Argument(ast.Integer8u, "Arg{}".format(i)) for i in range(count)])
+
+
+def _names(message):
+    return [arg.name for arg in message.args]
+
+
+def _check_index(message):
+    for i, arg in enumerate(message.args):
+        assert arg.parent is message and message.args.index(arg) == i
+
+
+@pytest.mark.parametrize("index", [slice(1, 3), slice(None, None, 2), slice(-3, None), slice(5, 1), slice(None)])
+def test_delete_slice(index):
+    message = _message(6)
+    expected = _names(message)
+    removed = message.args[index]
+    del expected[index]
+    del message.args[index]
+    assert _names(message) == expected
+    assert all(arg.parent is None for arg in removed)
+    _check_index(message)
+
+
+@pytest.mark.parametrize("index, count", [(slice(1, 3), 1), (slice(1, 3), 4), (slice(4, 4), 2), (slice(-1, None), 0)])
+def test_assign_slice(index, count):
+    message = _message(6)
+    expected = _names(message)
+    values = [ast.Argument(ast.Integer16s, "New{}".format(i)) for i in range(count)]
+    expected[index] = [value.name for value in values]
+    message.args[index] = values
+    assert _names(message) == expected
+    _check_index(message)
+
+
+def test_assign_slice_moves_children():
+    message = _message(5)
+    args = list(message.args)
+    message.args[1:3] = [args[4], args[2], args[1]]
+    assert _names(message) == ["Arg0", "Arg4", "Arg2", "Arg1", "Arg3"]
+    _check_index(message)
+
+
+def test_assign_extended_slice():
+    message = _message(6)
+    args = list(message.args)
+    message.args[::2] = [args[4], args[2], args[0]]
+    assert _names(message) == ["Arg4", "Arg1", "Arg2", "Arg3", "Arg0", "Arg5"]
+    _check_index(message)
+    with pytest.raises(ValueError):
+        message.args[::2] = [args[0]]
+
+
+def test_random_edits():
+    rnd = random.Random(1)
+    message = _message(50)
+    expected = list(message.args)
+    for step in range(2000):
+        operation = rnd.randrange(3)
+        if operation == 0 and expected:
+            index = rnd.randrange(len(expected))
+            del message.args[index]
+            del expected[index]
+        elif operation == 1 and expected:
+            # moves a child, the index counts children without it
+            child = rnd.choice(expected)
+            index = rnd.randrange(len(expected))
+            message.args.insert(index, child)
+            expected.remove(child)
+            expected.insert(index, child)
+        else:
+            index = rnd.randrange(len(expected) + 1)
+            child = ast.Argument(ast.Integer8u, "New{}".format(step))
+            message.args.insert(index, child)
+            expected.insert(index, child)
+        assert list(message.args) == expected
+    _check_index(message)
@@ -0,0 +1,71 @@
+from io import BytesIO
+
+from urpc import ast
+from urpc.storage.binary import BinaryStorage
+from urpc.storage.journal import Journal, digest, header, replay
+
+
+def _protocol():
+    commands = [
+        ast.Command(
+            "c{:03d}".format(i), "cmd{}".format(i),
+            ast.Message([ast.Argument(ast.Integer32s, "Arg{}".format(i))]), ast.Message()
+        )
+        for i in range(5)
+    ]
+    return ast.Protocol("test", "1.0.0", commands)
+
+
+def _journaled(edit):
+    protocol = _protocol()
+    snapshot = BytesIO()
+    BinaryStorage().save(protocol, snapshot)
+    file = BytesIO()
+    file.write(header(digest(snapshot.getvalue())))
+    protocol.journal = Journal(file)
+    edit(protocol)
+
+    replayed = BinaryStorage().load(BytesIO(snapshot.getvalue()))
+    assert replay(replayed, file.getvalue(), digest(snapshot.getvalue())) == len(file.getvalue())
+    return protocol, replayed
+
+
+def _same(a, b):
+    assert type(a) is type(b) and a.uid == b.uid
+    assert dict(a.props) == dict(b.props)
+    assert len(a.children) == len(b.children)
+    for x, y in zip(a.children, b.children):
+        _same(x, y)
+
+
+def test_swap_commands():
+    def edit(protocol):
+        commands = protocol.commands
+        commands[0], commands[1] = commands[1], commands[0]
+
+    _same(*_journaled(edit))
+
+
+def test_reverse_commands():
+    _same(*_journaled(lambda protocol: protocol.commands.reverse()))
+
+
+def test_move_argument():
+    def edit(protocol):
+        args = protocol.commands[2].request.args
+        args.append(ast.Argument(ast.Integer8u, "Second"))
+        args[0], args[1] = args[1], args[0]
+
+    _same(*_journaled(edit))
+
+
+def test_slices():
+    def edit(protocol):
+        commands = protocol.commands
+        del commands[1:3]
+        commands[0:1] = [commands[2], commands[0]]
+        args = commands[1].request.args
+        args[:] = [ast.Argument(ast.Integer8u, "First"), ast.Argument(ast.Integer16u, "Second")]
+        args[::-1] = list(args)
+
+    _same(*_journaled(edit))
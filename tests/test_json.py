@@ -0,0 +1,25 @@
+import json
+from io import BytesIO
+
+import pytest
+
+from urpc import ast
+from urpc.storage.json import JsonStorage
+
+
+def _document():
+    command = ast.Command("c000", "cmd", ast.Message([ast.Argument(ast.Integer8u, "Arg")]), ast.Message())
+    output = BytesIO()
+    JsonStorage().save(ast.Protocol("test", "1.0.0", [command]), output)
+    return json.loads(output.getvalue().decode("utf-8"))
+
+
+@pytest.mark.parametrize("reference", [False, True])
+def test_invalid_type(reference):
+    document = _document()
+    document["commands"][0]["request"]["args"][0]["type"] = "integer128"
+    with pytest.raises(ValueError) as error:
+        JsonStorage().load(BytesIO(json.dumps(document).encode("utf-8")), reference=reference)
+    assert "Not a valid type." in str(error.value)
+    if not reference:
+        assert str(error.value).startswith("commands.0.request.args.0.type:")
@@ -0,0 +1,18 @@
+from urpc import ast
+
+
+def _command(cid, name):
+    return ast.Command(cid, name, ast.Message(), ast.Message())
+
+
+def test_same_name_keeps_order():
+    first, second = _command("c001", "cmd"), _command("c002", "cmd")
+    protocol = ast.Protocol("test", "1.0.0", [first, second])
+    first.name = "cmd"
+    first.cid = "c001"
+    assert protocol.command_by_name("cmd") is first
+    assert protocol.command_by_cid("c001") is first
+
+    first.name = "other"
+    assert protocol.command_by_name("cmd") is second
+    assert protocol.command_by_name("other") is first
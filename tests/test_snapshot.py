@@ -0,0 +1,53 @@
+from io import BytesIO
+from zipfile import ZipFile
+
+from urpc import ast
+from urpc.builder.adapters import tango
+
+
+def _protocol():
+    commands = []
+    for i in range(3):
+        args = [ast.Argument(ast.Integer32s, "Value{}".format(j)) for j in range(2)]
+        commands.append(ast.Command("gv{:02d}".format(i), "get_value{}".format(i), ast.Message(), ast.Message(args)))
+        args = [ast.Argument(ast.Integer32s, "Value{}".format(j)) for j in range(2)]
+        commands.append(ast.Command("sv{:02d}".format(i), "set_value{}".format(i), ast.Message(args), ast.Message()))
+    commands.append(ast.Command("strt", "start", ast.Message([ast.Argument(ast.Integer8u, "Mode")]), ast.Message()))
+    return ast.Protocol("test", "1.0.0", commands)
+
+
+def _members(output):
+    archive = ZipFile(BytesIO(output.getvalue()))
+    return {name: archive.read(name) for name in archive.namelist()}
+
+
+def _check_parents(node):
+    for child in node.children:
+        assert child.parent is node
+        _check_parents(child)
+
+
+def test_snapshots_keep_their_parents():
+    protocol = _protocol()
+    old = protocol.snapshot()
+    protocol.commands[0].request.args.append(ast.Argument(ast.Integer8u, "Added"))
+    protocol.commands[-1].name = "begin"
+    new = protocol.snapshot()
+
+    _check_parents(old)
+    _check_parents(new)
+    assert old.commands[-1].name == "start" and new.commands[-1].name == "begin"
+
+
+def test_build_older_snapshot_after_edit():
+    protocol = _protocol()
+    old = protocol.snapshot()
+    expected = BytesIO()
+    tango.build(old, expected)
+
+    protocol.commands[1].name = "set_other"
+    protocol.snapshot()
+    output = BytesIO()
+    tango.build(old, output)
+    # archives differ by timestamps
+    assert _members(output) == _members(expected)
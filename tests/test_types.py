@@ -0,0 +1,20 @@
+import pickle
+
+import pytest
+
+from urpc import ast
+
+
+def test_keyword_arguments():
+    assert ast.IntegerType(size=4, signed=True) is ast.Integer32s
+    assert ast.IntegerType(False, size=2) is ast.Integer16u
+    assert ast.FloatType(size=4) is ast.Float
+    assert ast.ArrayType(ast.Integer8u, length=3) is ast.ArrayType(ast.Integer8u, 3)
+    assert pickle.loads(pickle.dumps(ast.IntegerType(size=1, signed=False))) is ast.Integer8u
+
+
+def test_wrong_arguments():
+    with pytest.raises(TypeError):
+        ast.IntegerType(True, width=4)
+    with pytest.raises(TypeError):
+        ast.IntegerType(True, signed=True)
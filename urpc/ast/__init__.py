@@ -1,9 +1,12 @@
 from urpc.ast.ast import AstNode, FlagConstant, Argument, Message, Command, Protocol
+from urpc.ast.layout import FieldLayout, MessageLayout
+from urpc.ast.options import ExtraOptions, parse_extra_options
 from urpc.ast.types import FieldTypeMeta, FieldType, IntegerType, FloatType, ArrayType, Integer64s, \
     Integer64u, Integer32s, Integer32u, Integer16s, Integer16u, Integer8s, Integer8u, Float, Array
 
 __all__ = [
-    "AstNode", "FlagConstant", "Argument", "Message", "Command", "Protocol", "FieldTypeMeta",
-    "FieldType", "IntegerType", "FloatType", "ArrayType", "Integer64s",
+    "AstNode", "FlagConstant", "Argument", "Message", "Command", "Protocol", "FieldLayout", "MessageLayout",
+    "ExtraOptions", "parse_extra_options", "FieldTypeMeta", "FieldType", "IntegerType", "FloatType", "ArrayType",
+    "Integer64s",
     "Integer64u", "Integer32s", "Integer32u", "Integer16s", "Integer16u", "Integer8s", "Integer8u", "Float", "Array"
 ]
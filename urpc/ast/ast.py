@@ -1,22 +1,106 @@
 import re
 from abc import ABCMeta
+from bisect import bisect_left, bisect_right, insort
 from collections.abc import MutableMapping, MutableSequence
+from hashlib import blake2b
+from itertools import count
+from threading import RLock
+from types import MappingProxyType
 from typing import Optional
 from uuid import uuid4
 
+from urpc.ast.layout import MessageLayout
+from urpc.ast.options import parse_extra_options
 from urpc.util.idhash import IdentityHash
 
+# Shared placeholders keep empty containers from allocating anything per node
+_no_slots = ()
+_no_holes = ()
+_no_children = MappingProxyType({})
+# protocol revision numbers
+_revisions = count(1)
+# snapshots are walked by several threads at once, so lazy children are loaded by one thread at a time
+_loading = RLock()
+_cid_pattern = re.compile(r"^[a-zA-Z][a-zA-Z0-9]{3}$")
+
 
 # Abstract protocol syntax is represented as polytree
 class AstNode(IdentityHash, metaclass=ABCMeta):
+    # Protocols may hold tens of thousands of nodes, so nodes and their helpers don't carry a __dict__
+    __slots__ = (
+        "_props", "_description", "_extra_options", "_options", "uid", "_children", "_parent", "_fingerprint",
+        "_snapshot", "__weakref__"
+    )
+    # slots holding values derived from the rest of the node
+    _caches = ("_snapshot", "_options")
+    # only protocols may have a journal
+    _journal = None
+
+    class Properties(MutableMapping):
+        """
+        Node properties. Any change invalidates structural fingerprints of the node and its ancestors.
+        """
+
+        __slots__ = ("_node", "_data")
+
+        def __init__(self, node, data=None):
+            self._node = node
+            # nothing depends on a new node yet, so the values are only checked
+            if data:
+                for key, value in data.items():
+                    self._check(key, value)
+            self._data = dict(data) if data else {}
+
+        # raises ValueError for values not allowed for the key
+        def _check(self, key, value):
+            pass
+
+        def __iter__(self):
+            return self._data.__iter__()
+
+        def __len__(self):
+            return self._data.__len__()
+
+        def __getitem__(self, key):
+            return self._data.__getitem__(key)
+
+        def __setitem__(self, key, value):
+            self._check(key, value)
+            self._node._check_mutable()
+            parent = self._node._parent
+            if parent is not None:
+                parent._child_changing(self._node, key, value)
+            self._data.__setitem__(key, value)
+            self._node._invalidate()
+            self._node._record("set", key, value)
+
+        def __delitem__(self, key):
+            self._node._check_mutable()
+            self._data.__delitem__(key)
+            self._node._invalidate()
+            self._node._record("unset", key)
+
     class Description(MutableMapping):
+        __slots__ = ("_langs", "_node")
+
         codes = {"english", "russian"}
 
         def __init__(self, **kwargs):
+            # node owning the description, set once the description is given to a node
+            self._node = None
             self._langs = {}
             for code in self.codes:
                 self._langs[code] = kwargs[code] if code in kwargs else ""
 
+        def _changing(self):
+            if self._node is not None:
+                self._node._check_mutable()
+                self._node._invalidate(structure=False)
+
+        def _changed(self):
+            if self._node is not None:
+                self._node._record("describe", dict(self._langs))
+
         def __iter__(self):
             return self._langs.__iter__()
 
@@ -24,12 +108,16 @@ class AstNode(IdentityHash, metaclass=ABCMeta):
             return self._langs.__len__()
 
         def __delitem__(self, key):
-            return self._langs.__delitem__(key)
+            self._changing()
+            self._langs.__delitem__(key)
+            self._changed()
 
         def __setitem__(self, key, value):
             if key not in self.codes:
                 raise AttributeError
-            return self._langs.__setitem__(key, value)
+            self._changing()
+            self._langs.__setitem__(key, value)
+            self._changed()
 
         def __getitem__(self, key):
             if key not in self.codes:
@@ -37,39 +125,306 @@ class AstNode(IdentityHash, metaclass=ABCMeta):
             return self._langs.__getitem__(key)
 
     class Children(MutableSequence):
+        """
+        Ordered container of child nodes.
+
+        Children are indexed by identity, so membership tests, index lookups and removals don't scan the
+        sequence. Removed children leave a hole in the storage which is skipped on access and squeezed out
+        once holes take up half of it.
+        """
+
+        __slots__ = ("_node", "_slots", "_slot_by_child", "_holes")
+
         def __init__(self, node):
             self._node = node
-            # TODO: remove and index list ops are O(n). Replace with custom O(1) MutableSequence?
-            self._children = []
+            # children in order, removed ones are replaced with None
+            self._slots = _no_slots
+            # child -> position of the child in self._slots
+            self._slot_by_child = _no_children
+            # sorted positions of holes in self._slots
+            self._holes = _no_holes
 
         @property
         def node(self):
             return self._node
 
+        # identity index can't be copied as is, it is rebuilt for the copied children instead
+        def __getstate__(self):
+            return {"node": self._node, "children": list(self)}
+
+        def __setstate__(self, state):
+            self._node = state["node"]
+            self._slots = state["children"] or _no_slots
+            self._slot_by_child = {c: i for i, c in enumerate(self._slots)} if self._slots else _no_children
+            self._holes = _no_holes
+
+        def _to_slot(self, index):
+            length = len(self)
+            if index < 0:
+                index += length
+            if not 0 <= index < length:
+                raise IndexError("child index out of range")
+            if not self._holes:
+                return index
+
+            # find the first slot having exactly index live slots before it
+            low, high = index, index + len(self._holes)
+            while low < high:
+                middle = (low + high) // 2
+                if middle - bisect_right(self._holes, middle) < index:
+                    low = middle + 1
+                else:
+                    high = middle
+            while self._slots[low] is None:
+                low += 1
+            return low
+
+        def _to_index(self, slot):
+            return slot - bisect_left(self._holes, slot)
+
+        def _compact(self):
+            if not self._holes:
+                return
+            self._slots = [c for c in self._slots if c is not None]
+            self._holes = _no_holes
+            self._slot_by_child = {c: i for i, c in enumerate(self._slots)}
+
+        def _check_attachable(self, value):
+            self._node._check_mutable()
+            if value._parent is not None:
+                value._parent._check_mutable()
+
+        def _attach(self, value):
+            if value._parent is not None:
+                value._parent.children.remove(value)
+            value._parent = self._node
+
+        # links children which have no parent yet
+        def _assign(self, children):
+            self._slots = list(children) or _no_slots
+            self._slot_by_child = {}
+            for slot, child in enumerate(self._slots):
+                self._node._adopt(child)
+                child._parent = self._node
+                self._slot_by_child[child] = slot
+
         def __getitem__(self, index):
-            return self._children.__getitem__(index)
+            if isinstance(index, slice):
+                self._compact()
+                return self._slots[index]
+            return self._slots[self._to_slot(index)]
 
         def __len__(self):
-            return self._children.__len__()
+            return len(self._slots) - len(self._holes)
+
+        def __iter__(self):
+            return (c for c in self._slots if c is not None)
+
+        def __contains__(self, value):
+            return isinstance(value, AstNode) and value in self._slot_by_child
+
+        def index(self, value, start=0, stop=None):
+            try:
+                index = self._to_index(self._slot_by_child[value])
+            except (KeyError, TypeError):
+                raise ValueError("node is not a child")
+            if index < start or (stop is not None and index >= stop):
+                raise ValueError("node is not a child in the given range")
+            return index
 
         def insert(self, index, value):
             if not isinstance(value, AstNode):
                 raise ValueError
-            self._children.append(value)
-            value.parent = self._node
+            self._check_attachable(value)
+            if value._parent is self._node:
+                # inserting a child once again moves it
+                self.remove(value)
+            self._node._adopt(value)
+            self._attach(value)
+            self._node._invalidate()
+            if self._slots is _no_slots:
+                self._slots, self._slot_by_child = [], {}
+            length = len(self)
+            if index < 0:
+                index = max(index + length, 0)
+            if index >= length:
+                index = length
+                self._slot_by_child[value] = len(self._slots)
+                self._slots.append(value)
+            else:
+                self._insert_slot(self._to_slot(index), value)
+            self._node._record("insert", index, value)
+
+        # Puts the value before the child at the slot. Children between the slot and the nearest hole are shifted
+        # into the hole, so moving a child costs as much as the distance it is moved by.
+        def _insert_slot(self, slot, value):
+            position = bisect_left(self._holes, slot)
+            after = self._holes[position] if position < len(self._holes) else None
+            before = self._holes[position - 1] if position else None
+            if after is None and before is None:
+                self._slots.insert(slot, value)
+                changed = range(slot, len(self._slots))
+            elif before is None or (after is not None and after - slot <= slot - before):
+                self._slots[slot + 1:after + 1] = self._slots[slot:after]
+                self._slots[slot] = value
+                changed = range(slot, after + 1)
+                del self._holes[position]
+            else:
+                self._slots[before:slot - 1] = self._slots[before + 1:slot]
+                self._slots[slot - 1] = value
+                changed = range(before, slot)
+                del self._holes[position - 1]
+            for slot in changed:
+                self._slot_by_child[self._slots[slot]] = slot
+
+        # same as appending one by one, but ancestors are invalidated once
+        def extend(self, values):
+            if values is self:
+                values = list(values)
+            extended = False
+            try:
+                for value in values:
+                    extended = True
+                    if not isinstance(value, AstNode) or value._parent is not None:
+                        # rejected or moved as usual
+                        self.insert(len(self), value)
+                        continue
+                    self._node._check_mutable()
+                    self._node._adopt(value)
+                    value._parent = self._node
+                    if self._slots is _no_slots:
+                        self._slots, self._slot_by_child = [], {}
+                    self._slot_by_child[value] = len(self._slots)
+                    self._slots.append(value)
+                    self._node._record("insert", len(self) - 1, value)
+            finally:
+                if extended:
+                    self._node._invalidate()
 
         def __delitem__(self, index):
-            try:
-                child = self._children.pop(index)
-                child.parent = None
-            except ValueError:
-                pass
+            if isinstance(index, slice):
+                # children are deleted from the end, so the indices of the rest stay the same
+                for i in sorted(range(*index.indices(len(self))), reverse=True):
+                    del self[i]
+                return
+            self._node._check_mutable()
+            self._node._invalidate()
+            slot = self._to_slot(index)
+            index = self._to_index(slot)
+            child = self._slots[slot]
+            if self._slot_by_child.get(child) == slot:
+                del self._slot_by_child[child]
+                child._parent = None
+                self._node._release(child)
+
+            if slot == len(self._slots) - 1:
+                self._slots.pop()
+                while self._holes and self._holes[-1] == len(self._slots) - 1:
+                    self._holes.pop()
+                    self._slots.pop()
+            else:
+                self._slots[slot] = None
+                if self._holes:
+                    insort(self._holes, slot)
+                else:
+                    self._holes = [slot]
+                if 2 * len(self._holes) > len(self._slots):
+                    self._compact()
+            self._node._record("delete", index)
 
         def __setitem__(self, index, value):
-            if index in self._children:
-                self._children[index].parent = None
-            self._children[index] = value
-            value.parent = self._node
+            if isinstance(index, slice):
+                self._set_slice(index, list(value))
+                return
+            if not isinstance(value, AstNode):
+                raise ValueError
+            self._check_attachable(value)
+            slot = self._to_slot(index)
+            old = self._slots[slot]
+            if old is value:
+                return
+            # the same node may be listed twice in the middle of a swap, it stays attached in that case
+            detach_old = self._slot_by_child.get(old) == slot
+            if value._parent is not self._node:
+                self._node._adopt(value, old if detach_old else None)
+            self._node._invalidate()
+            if detach_old:
+                del self._slot_by_child[old]
+                old._parent = None
+                self._node._release(old)
+            if value._parent is not self._node:
+                self._attach(value)
+            self._slots[slot] = value
+            self._slot_by_child[value] = slot
+            self._node._record("replace", self._to_index(slot), value)
+
+        # Same as for lists, but a node may be listed once only: values which are children already are moved.
+        def _set_slice(self, index, values):
+            if not all(isinstance(value, AstNode) for value in values):
+                raise ValueError
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                indices = range(start, stop, step)
+                if len(values) != len(indices):
+                    raise ValueError("attempt to assign sequence of size {} to extended slice of size {}".format(
+                        len(values), len(indices)
+                    ))
+                for i, value in zip(indices, values):
+                    self[i] = value
+                return
+
+            del self[start:stop]
+            for value in values:
+                if value in self:
+                    position = self.index(value)
+                    if position < start:
+                        start -= 1
+                    del self[position]
+            for offset, value in enumerate(values):
+                self.insert(start + offset, value)
+
+    class LazyChildren(Children):
+        """
+        Children loaded by load() on the first access, load is a callable returning the children. The number
+        of children is known beforehand, so taking the length doesn't load them.
+        """
+
+        __slots__ = ("_count", "_load")
+
+        def __init__(self, node, count, load):
+            # storage slots stay unset until the children are loaded, see __getattr__()
+            self._node = node
+            self._count = count
+            self._load = load
+
+        # Called for unset slots only. Storage slots are set once complete and _slots last, so other threads
+        # either see the children loaded or load them as well and wait.
+        def __getattr__(self, name):
+            if name not in ("_slots", "_slot_by_child", "_holes"):
+                raise AttributeError(name)
+            with _loading:
+                if self._load is not None:
+                    children = list(self._load())
+                    slot_by_child = {}
+                    for slot, child in enumerate(children):
+                        self._node._adopt(child)
+                        child._parent = self._node
+                        slot_by_child[child] = slot
+                    self._holes = _no_holes
+                    self._slot_by_child = slot_by_child
+                    self._slots = children or _no_slots
+                    self._load = None
+            return getattr(self, name)
+
+        def __len__(self):
+            if self._load is not None:
+                return self._count
+            return super().__len__()
+
+        # children are loaded to be copied, copies have them loaded as well
+        def __setstate__(self, state):
+            self._load = None
+            super().__setstate__(state)
 
     def __init__(
             self,
@@ -82,13 +437,19 @@ class AstNode(IdentityHash, metaclass=ABCMeta):
     ):
         if props:
             assert isinstance(props, MutableMapping)
-        self._props = props or {}
-        self._description = description or self.Description()
+        self._fingerprint = None
+        self._snapshot = None
+        self._parent = None
+        self._props = self.Properties(self, props)
+        # description is allocated on the first access
+        self._description = _empty_description
+        if description:
+            self._set_description(description)
         self._extra_options = "" if extra_options is None else extra_options
+        self._options = None
         self.uid = uid or uuid4()
         self._children = AstNode.Children(self)
 
-        self._parent = None
         if parent:
             # trigger setter
             self.parent = parent
@@ -96,6 +457,20 @@ class AstNode(IdentityHash, metaclass=ABCMeta):
         if children:
             self._children.extend(children)
 
+    @classmethod
+    def _lazy(cls, props, count, load, description=None, extra_options=None, uid=None, fingerprint=None):
+        """
+        Creates a node having count children loaded by load() on the first access, see LazyChildren. Storages use
+        it to defer decoding of subtrees, they may provide the fingerprint stored along with the subtree.
+        """
+        node = cls.__new__(cls)
+        for name in cls._caches:
+            setattr(node, name, None)
+        AstNode.__init__(node, props, None, description, extra_options, None, uid)
+        node._children = AstNode.LazyChildren(node, count, load)
+        node._fingerprint = fingerprint
+        return node
+
     # @property
     # def neighbors(self):
     #     return iter(self._neighbors)
@@ -108,11 +483,166 @@ class AstNode(IdentityHash, metaclass=ABCMeta):
     # def outgoing(self):
     #     return self._outgoing
 
-    # checks structural equality of two nodes
-    def compare(self, other):
+    @property
+    def fingerprint(self):
+        """
+        Structural hash of the subtree: node type, properties and fingerprints of the children.
+        Descriptions, extra options and uids are not taken into account, same as in compare().
+        The value is cached until the node or any of its descendants changes.
+        """
+        if self._fingerprint is None:
+            digest = blake2b(repr((type(self).__name__, sorted(self._props.items()))).encode(), digest_size=16)
+            for child in self.children:
+                digest.update(child.fingerprint)
+            self._fingerprint = digest.digest()
+        return self._fingerprint
+
+    # Drops cached fingerprints and snapshots of the node and its ancestors and lets them know about the change,
+    # changes of descriptions and extra options don't affect fingerprints. The walk doesn't stop at the first
+    # ancestor without cached values: every ancestor is touched, and trees are at most five nodes deep.
+    def _invalidate(self, structure=True):
+        node = self
+        while node is not None:
+            if structure:
+                node._fingerprint = None
+            node._snapshot = None
+            node._touch()
+            node = node._parent
+
+    # called for a node whenever anything in its subtree changes
+    def _touch(self):
+        pass
+
+    # Passes a change of the node to the journal of its protocol if there is one, see Protocol.journal. Changes are
+    # passed once made, the node is the changed one for properties and the parent for children.
+    def _record(self, operation, *args):
+        node = self
+        while node._parent is not None:
+            node = node._parent
+        if node._journal is not None:
+            node._journal.record(operation, self, *args)
+
+    def _check_mutable(self):
+        if self._snapshot is self:
+            raise TypeError("{} snapshot is immutable".format(type(self).__name__))
+
+    # copy of the node itself, without children and parent
+    def _clone(self):
+        clone = object.__new__(type(self))
+        clone._fingerprint = self._fingerprint
+        clone._snapshot = None
+        clone._parent = None
+        clone._props = clone.Properties(clone)
+        clone._props._data = dict(self._props._data)
+        clone._description = _empty_description
+        if self._description is not _empty_description:
+            clone._set_description(self._description)
+        clone._extra_options = self._extra_options
+        clone._options = self._options
+        clone.uid = self.uid
+        clone._children = AstNode.Children(clone)
+        return clone
+
+    def snapshot(self):
+        """
+        Returns an immutable copy of the subtree. The copy is cached until the subtree changes, so successive
+        snapshots share unchanged subtrees and a snapshot costs only the nodes changed since the previous one and
+        their children. Every snapshot has its own parents, see _link().
+        """
+        frozen = self._snapshot
+        if frozen is None:
+            frozen = self._clone()
+            children = self._children
+            if isinstance(children, AstNode.LazyChildren) and children._load is not None:
+                # children not loaded yet haven't changed, the snapshot loads its own copies of them
+                load = children._load
+                frozen._children = AstNode.LazyChildren(frozen, len(children), lambda: [c._freeze() for c in load()])
+            else:
+                frozen._children._assign(c.snapshot()._shared() for c in children)
+            frozen._snapshot = frozen
+            self._snapshot = frozen
+        return frozen
+
+    # makes a node just loaded and used by nothing else frozen in place, children it loads later are frozen too
+    def _freeze(self):
+        self._snapshot = self
+        children = self._children
+        if isinstance(children, AstNode.LazyChildren) and children._load is not None:
+            load = children._load
+            children._load = lambda: [c._freeze() for c in load()]
+        else:
+            for child in children:
+                child._freeze()
+        return self
+
+    # frozen node to be attached to a snapshot, the node itself unless it is attached to another one already
+    def _shared(self):
+        return self if self._parent is None else self._link()
+
+    # Frozen copy of a frozen node attached to another snapshot. It shares the content of the node, and its
+    # children are links of the node children made on the first access, so a subtree shared by snapshots is
+    # copied only as far as it is walked through.
+    def _link(self):
+        link = object.__new__(type(self))
+        # frozen content doesn't change, so it is shared as is
+        link._fingerprint = self._fingerprint
+        link._snapshot = link
+        link._parent = None
+        link._props = self._props
+        link._description = self._description
+        link._extra_options = self._extra_options
+        link._options = self._options
+        link.uid = self.uid
+        children = self._children
+        link._children = AstNode.LazyChildren(link, len(children), lambda: [c._link() for c in children])
+        return link
+
+    def fork(self):
+        """
+        Returns a mutable copy of the subtree keeping uids, works for snapshots as well.
+        """
+        clone = self._clone()
+        clone._children._assign(c.fork() for c in self._children)
+        return clone
+
+    # caches are not a part of the state, copies of snapshots are mutable
+    def __getstate__(self):
+        return {
+            name: getattr(self, name)
+            for cls in type(self).__mro__ for name in getattr(cls, "__slots__", ())
+            if name not in self._caches and name != "__weakref__"
+        }
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        for name in self._caches:
+            setattr(self, name, None)
+
+    # Hooks for nodes which index their children. _adopt() is called before a child is attached, possibly in place
+    # of another one, _release() after a child is detached and _child_changing() before a property of a child
+    # is changed. Attaching and changing may be refused with ValueError.
+    def _adopt(self, child, replaced=None):
+        pass
+
+    def _release(self, child):
+        pass
+
+    def _child_changing(self, child, key, value):
+        pass
+
+    # checks structural equality of two nodes, deep check compares subtrees node by node instead of trusting
+    # matching fingerprints
+    def compare(self, other, deep=False):
         if not isinstance(other, type(self)):
             return False
 
+        if self.fingerprint != other.fingerprint:
+            return False
+
+        if not deep:
+            return True
+
         if len(self.children) != len(other.children):
             return False
 
@@ -123,7 +653,7 @@ class AstNode(IdentityHash, metaclass=ABCMeta):
             if self.props[k] != other.props[k]:
                 return False
 
-        return all(c.compare(other.children[i]) for i, c in enumerate(self.children))
+        return all(c.compare(other.children[i], deep) for i, c in enumerate(self.children))
 
     @property
     def props(self):
@@ -135,15 +665,37 @@ class AstNode(IdentityHash, metaclass=ABCMeta):
 
     @property
     def description(self):
+        if self._description is _empty_description:
+            self._set_description(self.Description())
         return self._description
 
+    def _set_description(self, description):
+        # a description belongs to a single node
+        if description._node is not None and description._node is not self:
+            description = self.Description(**description)
+        description._node = self
+        self._description = description
+
     @property
     def extra_options(self) -> str:
         return self._extra_options
 
     @extra_options.setter
     def extra_options(self, value: str) -> None:
+        self._check_mutable()
+        self._invalidate(structure=False)
         self._extra_options = value
+        self._options = None
+        self._record("options", value)
+
+    @property
+    def options(self):
+        """
+        Parsed view of extra options with typed getters, cached until extra options are set.
+        """
+        if self._options is None:
+            self._options = parse_extra_options(self._extra_options)
+        return self._options
 
     @property
     def parent(self):
@@ -155,15 +707,20 @@ class AstNode(IdentityHash, metaclass=ABCMeta):
 
         if value is self._parent:
             return
-        if self._parent is not None:
+        if value is None:
+            # resets the link
             self._parent.children.remove(self)
-        if value is not None and self not in value.children:
+        else:
+            # detaches from the former parent and sets the link
             value.children.append(self)
 
-        self._parent = value
+
+_empty_description = AstNode.Description()
 
 
 class FlagConstant(AstNode):
+    __slots__ = ()
+
     def __init__(self, name, value, description=None, extra_options=None, parent=None, uid=None):
         super().__init__(
             props={"name": name, "value": value},
@@ -195,6 +752,8 @@ class FlagConstant(AstNode):
 
 
 class Argument(AstNode):
+    __slots__ = ()
+
     def __init__(self, type_, name, description=None, consts=None, extra_options=None, parent=None,
                  uid=None):
         super().__init__(
@@ -233,7 +792,11 @@ class Argument(AstNode):
 
 
 class Message(AstNode):
+    __slots__ = ("_layout",)
+    _caches = AstNode._caches + ("_layout",)
+
     def __init__(self, args=None, description=None, extra_options=None, parent=None, uid=None):
+        self._layout = None
         super().__init__(
             props=None,
             children=args,
@@ -252,28 +815,44 @@ class Message(AstNode):
         self.children.clear()
         self.children.extend(value)
 
+    @property
+    def layout(self):
+        """
+        Wire layout of the message, cached until arguments change.
+        """
+        if self._layout is None:
+            self._layout = MessageLayout(self.children)
+        return self._layout
 
-class Command(AstNode):
-    class Properties(MutableMapping):
-        def __init__(self):
-            self._data = {}
+    def _clone(self):
+        clone = super()._clone()
+        clone._layout = None
+        return clone
 
-        def __iter__(self):
-            return self._data.__iter__()
+    def _link(self):
+        link = super()._link()
+        link._layout = self._layout
+        return link
 
-        def __setitem__(self, key, value):
-            if key == "cid" and not re.match(r"^[a-zA-Z][a-zA-Z0-9]{3}$", value):
-                raise ValueError("CID must be exactly 4 symbols string")
-            return self._data.__setitem__(key, value)
+    def _adopt(self, child, replaced=None):
+        self._layout = None
 
-        def __delitem__(self, key):
-            return self._data.__delitem__(key)
+    def _release(self, child):
+        self._layout = None
 
-        def __len__(self):
-            return self._data.__len__()
+    def _child_changing(self, child, key, value):
+        self._layout = None
 
-        def __getitem__(self, key):
-            return self._data.__getitem__(key)
+
+class Command(AstNode):
+    __slots__ = ()
+
+    class Properties(AstNode.Properties):
+        __slots__ = ()
+
+        def _check(self, key, value):
+            if key == "cid" and not _cid_pattern.match(value):
+                raise ValueError("CID must be exactly 4 symbols string")
 
     def __init__(
             self,
@@ -281,12 +860,8 @@ class Command(AstNode):
             request=None, response=None, description=None, extra_options=None,
             parent=None, uid=None
     ):
-        props = Command.Properties()
-        props["cid"] = cid
-        props["name"] = name
-
         super().__init__(
-            props=props,
+            props={"cid": cid, "name": name},
             children=[request or Message(), response or Message()],
             description=description,
             extra_options=extra_options,
@@ -331,7 +906,18 @@ class Command(AstNode):
 
 
 class Protocol(AstNode):
+    __slots__ = ("_commands_by_cid", "_commands_by_name", "_revision", "_memo", "_journal")
+    # the journal belongs to this very protocol, copies don't have it
+    _caches = AstNode._caches + ("_revision", "_memo", "_journal")
+
     def __init__(self, name, version, commands=None, extra_options=None, uid=None):
+        # Commands are indexed as they are attached and renamed. CIDs are unique, names are not necessarily:
+        # an imported protocol may have duplicate names until they are fixed up.
+        self._commands_by_cid = {}
+        self._commands_by_name = {}
+        self._revision = None
+        self._memo = None
+        self._journal = None
         super().__init__(
             props={"name": name, "version": version},
             children=commands,
@@ -365,3 +951,105 @@ class Protocol(AstNode):
     def commands(self, value):
         self.children.clear()
         self.children.extend(value)
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._commands_by_cid = {}
+        clone._commands_by_name = {}
+        clone._revision = None
+        clone._memo = None
+        clone._journal = None
+        return clone
+
+    @property
+    def revision(self):
+        """
+        Number identifying the current state of the protocol: it changes on any change of the protocol
+        and is never reused, also by other protocols, copies and snapshots.
+        """
+        # numbers are taken lazily, so series of changes consume one
+        if self._revision is None:
+            self._revision = next(_revisions)
+        return self._revision
+
+    def memoize(self, key, compute):
+        """
+        Returns compute() result for the current revision of the protocol, computing it once per revision.
+        """
+        if self._memo is None:
+            self._memo = {}
+        try:
+            return self._memo[key]
+        except KeyError:
+            return self._memo.setdefault(key, compute())
+
+    def _touch(self):
+        self._revision = None
+        self._memo = None
+
+    @property
+    def journal(self):
+        """
+        Receiver of the protocol changes, its record(operation, node, *args) method is called after every change
+        of the protocol or its descendants with one of:
+
+            "set", node, key, value       property of the node is set
+            "unset", node, key            property of the node is deleted
+            "describe", node, langs       description of the node is changed, langs holds all of its texts
+            "options", node, value        extra options of the node are set
+            "insert", parent, index, child
+            "delete", parent, index
+            "replace", parent, index, child
+
+        Moving a node is recorded as deleting and inserting it. Snapshots and copies have no journal.
+        """
+        return self._journal
+
+    @journal.setter
+    def journal(self, value):
+        self._check_mutable()
+        self._journal = value
+
+    def command_by_cid(self, cid):
+        return self._commands_by_cid.get(cid)
+
+    def command_by_name(self, name):
+        commands = self._commands_by_name.get(name)
+        return commands[0] if commands else None
+
+    def _check_cid(self, cid, cmd, replaced=None):
+        other = self._commands_by_cid.get(cid)
+        if other is not None and other is not cmd and other is not replaced:
+            raise ValueError("CID {} is already used by {} command".format(cid, other.name))
+
+    def _index_name(self, cmd, name):
+        self._commands_by_name.setdefault(name, []).append(cmd)
+
+    def _unindex_name(self, cmd, name):
+        commands = self._commands_by_name[name]
+        commands.remove(cmd)
+        if not commands:
+            del self._commands_by_name[name]
+
+    def _adopt(self, child, replaced=None):
+        self._check_cid(child.cid, child, replaced)
+        self._commands_by_cid[child.cid] = child
+        self._index_name(child, child.name)
+
+    def _release(self, child):
+        if self._commands_by_cid.get(child.cid) is child:
+            del self._commands_by_cid[child.cid]
+        self._unindex_name(child, child.name)
+
+    def _child_changing(self, child, key, value):
+        if value == child.props.get(key):
+            # reindexing would move the command behind the others of the same name
+            return
+        if key == "cid":
+            self._check_cid(value, child)
+            if self._commands_by_cid.get(child.cid) is child:
+                del self._commands_by_cid[child.cid]
+            self._commands_by_cid[value] = child
+        elif key == "name":
+            self._unindex_name(child, child.name)
+            self._index_name(child, value)
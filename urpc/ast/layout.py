@@ -0,0 +1,40 @@
+from collections import namedtuple
+
+from urpc.ast.types import ArrayType
+
+# Placement of an argument in the message payload. Stride is the size of a single element, length is the number
+# of elements, both are the same as size and 1 for scalars.
+FieldLayout = namedtuple("FieldLayout", ("name", "offset", "size", "stride", "length"))
+
+
+class MessageLayout:
+    """
+    Wire layout of a message. Arguments are packed one after another without padding. A framed message carries
+    its CID ahead of the arguments and, if there are any arguments, CRC after them.
+    """
+
+    __slots__ = ("fields", "payload_size", "framed_size")
+
+    cid_size = 4
+    crc_size = 2
+
+    def __init__(self, args):
+        fields = []
+        offset = 0
+        for arg in args:
+            type_ = arg.type_
+            if isinstance(type_, ArrayType):
+                stride, length = type_.type_.size, len(type_)
+            else:
+                stride, length = type_.size, 1
+            fields.append(FieldLayout(arg.name, offset, type_.size, stride, length))
+            offset += type_.size
+
+        self.fields = tuple(fields)
+        self.payload_size = offset
+        self.framed_size = self.cid_size + offset + (self.crc_size if fields else 0)
+
+    def __repr__(self):
+        return "{}(fields={}, payload_size={}, framed_size={})".format(
+            type(self).__name__, self.fields, self.payload_size, self.framed_size
+        )
@@ -0,0 +1,64 @@
+from collections.abc import Mapping
+from functools import lru_cache
+
+
+class ExtraOptions(Mapping):
+    """
+    Parsed extra options string: comma separated "key=value" entries or bare "key" flags. Keys and values are
+    stripped, the first entry wins if a key repeats. Bare flags map to None and typed getters treat them as unset.
+    """
+
+    __slots__ = ("_raw", "_options")
+
+    def __init__(self, raw=""):
+        self._raw = raw
+        self._options = {}
+        for entry in raw.split(",") if raw else ():
+            key, sep, value = entry.partition("=")
+            key = key.strip()
+            if key and key not in self._options:
+                self._options[key] = value.strip() if sep else None
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def __getitem__(self, key):
+        return self._options[key]
+
+    def __iter__(self):
+        return iter(self._options)
+
+    def __len__(self):
+        return len(self._options)
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self._raw)
+
+    def get_str(self, key, default=None):
+        value = self._options.get(key)
+        return default if value is None else value
+
+    def get_bool(self, key, default=False):
+        value = self._options.get(key)
+        return default if value is None else value.lower() in ("true", "1")
+
+    def get_int(self, key, default=0):
+        value = self._options.get(key)
+        try:
+            return default if value is None else int(value)
+        except ValueError:
+            return default
+
+    def get_float(self, key, default=0.0):
+        value = self._options.get(key)
+        try:
+            return default if value is None else float(value)
+        except ValueError:
+            return default
+
+
+# Views are immutable, so nodes having the same extra options string share one
+@lru_cache(maxsize=4096)
+def parse_extra_options(raw):
+    return ExtraOptions(raw)
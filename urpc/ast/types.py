@@ -1,14 +1,44 @@
-# TODO: implement singleton for immutable FieldType objects
+from inspect import signature
+
+
 class FieldTypeMeta(type):
-    pass
+    """
+    Interns field types: instantiating a type with the same arguments always returns the same object,
+    so equal types are identical and may be compared with "is".
+    """
+
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        cls._instances = {}
+
+    def __call__(cls, *args, **kwargs):
+        if kwargs:
+            # types are interned by positional arguments, keyword ones are put in their places
+            bound = signature(cls.__init__).bind(None, *args, **kwargs)
+            bound.apply_defaults()
+            args = bound.args[1:]
+        try:
+            return cls._instances[args]
+        except KeyError:
+            return cls._instances.setdefault(args, super().__call__(*args))
 
 
 class FieldType(metaclass=FieldTypeMeta):
-    pass
+    __slots__ = ()
+
+    # copies and unpickled objects are interned as well
+    def __reduce__(self):
+        return type(self), self._args()
+
+    # arguments the type is made of, slots of types are named after them in the same order
+    def _args(self):
+        return tuple(getattr(self, name) for name in type(self).__slots__)
 
 
 # Immutable types descriptions
 class IntegerType(FieldType):
+    __slots__ = ("_signed", "_size")
+
     def __init__(self, signed, size):
         self._signed = signed
         self._size = size
@@ -21,15 +51,6 @@ class IntegerType(FieldType):
     def size(self):
         return self._size
 
-    def __eq__(self, other):
-        return isinstance(other, type(self)) and self._signed == other._signed and self._size == other._size
-
-    # def __ne__(self, other):
-    #     return not self.__eq__(other)
-
-    def __hash__(self):
-        return hash((self._signed, self._size))
-
     def __repr__(self):
         """
          Don't change, using in temlates
@@ -39,6 +60,8 @@ class IntegerType(FieldType):
 
 
 class FloatType(FieldType):
+    __slots__ = ("_size",)
+
     def __init__(self, size):
         self._size = size
 
@@ -46,17 +69,13 @@ class FloatType(FieldType):
     def size(self):
         return self._size
 
-    def __eq__(self, other):
-        return isinstance(other, type(self)) and self._size == other._size
-
-    def __hash__(self):
-        return hash(self._size)
-
     def __repr__(self):
         return "float"
 
 
 class ArrayType(FieldType):
+    __slots__ = ("_type", "_length")
+
     def __init__(self, _type, length):
         self._type = _type
         self._length = length
@@ -76,15 +95,6 @@ class ArrayType(FieldType):
     def __len__(self):
         return self._length
 
-    def __eq__(self, other):
-        return isinstance(other, type(self)) and self.type_ == other.type_ and self._length == other._length
-
-    def __ne__(self, other):
-        return not self.__eq__(other)
-
-    def __hash__(self):
-        return hash((self._type, self._length))
-
     def __repr__(self):
         return "{}[{}]".format(self.type_, len(self))
 
@@ -108,19 +108,19 @@ private:
 
         if type in (ast.Integer8s, ast.Integer8u):
             return "DEV_UCHAR"
-        elif type == ast.Integer16u:
+        elif type is ast.Integer16u:
             return "DEV_USHORT"
-        elif type == ast.Integer16s:
+        elif type is ast.Integer16s:
             return "DEV_SHORT"
-        elif type == ast.Integer32u:
+        elif type is ast.Integer32u:
             return "DEV_ULONG"
-        elif type == ast.Integer32s:
+        elif type is ast.Integer32s:
             return "DEV_LONG"
-        elif type == ast.Integer64u:
+        elif type is ast.Integer64u:
             return "DEV_ULONG64"
-        elif type == ast.Integer64s:
+        elif type is ast.Integer64s:
             return "DEV_LONG64"
-        elif type == ast.Float:
+        elif type is ast.Float:
             return "DEV_FLOAT"
         else:
             return "DEV_VOID"
@@ -187,7 +187,7 @@ class TangoView(ClangView):
     # TODO: this should also go away
     def is_accessor_part(self, cmd):
         assert isinstance(cmd, ast.Command) and cmd in self._project.children
-        return cmd not in self._commands
+        return cmd not in self._analysis.command_set
 
     # standalone utility functions
     def argstruct_for_cmd(self, msg):
@@ -225,40 +225,40 @@ class TangoView(ClangView):
     def cmd_has_reactive_attrs(self, cmd):
         assert isinstance(cmd, ast.Command)
 
-        default_is_reactive = get_extra_option(cmd.extra_options, "reactive", get_bool())
+        default_is_reactive = get_extra_option(cmd.options, "reactive", get_bool())
         return \
             not self.has_ext_args(cmd.request) and self.has_ext_args(cmd.response) \
             and any(
-                get_extra_option(arg.extra_options, "reactive", get_bool(default_is_reactive))
+                get_extra_option(arg.options, "reactive", get_bool(default_is_reactive))
                 for arg in cmd.response.children
             )
 
     def cmd_is_reactive(self, cmd):
         assert isinstance(cmd, ast.Command)
-        return get_extra_option(cmd.extra_options, "reactive", get_bool(False))
+        return get_extra_option(cmd.options, "reactive", get_bool(False))
 
     def cmd_poll_ms(self, cmd):
         assert isinstance(cmd, ast.Command)
-        return get_extra_option(cmd.extra_options, "poll_ms", get_int(1000))
+        return get_extra_option(cmd.options, "poll_ms", get_int(1000))
 
     def attr_is_reactive(self, arg):
         assert isinstance(arg, ast.Argument)
         return get_extra_option(
-            arg.extra_options,
+            arg.options,
             "reactive",
-            get_bool(get_extra_option(arg.parent.parent.extra_options, "reactive", get_bool()))
+            get_bool(get_extra_option(arg.parent.parent.options, "reactive", get_bool()))
         )
 
     def attr_delta_abs(self, arg):
         assert isinstance(arg, ast.Argument)
-        return get_extra_option(arg.extra_options, "delta_abs", get_number())
+        return get_extra_option(arg.options, "delta_abs", get_number())
 
     def attr_delta_rel(self, arg):
         assert isinstance(arg, ast.Argument)
-        return get_extra_option(arg.extra_options, "delta_rel", get_number())
+        return get_extra_option(arg.options, "delta_rel", get_number())
 
     def attr_get_option_by_name(self, arg, option):
-        return get_extra_option(arg.extra_options, option, get_str())
+        return get_extra_option(arg.options, option, get_str())
 
     def get_arg(self, msg):
         assert self.handled_internally(msg)
@@ -302,37 +302,30 @@ class TangoView(ClangView):
 
         if t in (ast.Integer8s, ast.Integer8u):
             return pattern.format("DevUChar")
-        elif t == ast.Integer16u:
+        elif t is ast.Integer16u:
             return pattern.format("DevUShort")
-        elif t == ast.Integer16s:
+        elif t is ast.Integer16s:
             return pattern.format("DevShort")
-        elif t == ast.Integer32u:
+        elif t is ast.Integer32u:
             return pattern.format("DevULong")
-        elif t == ast.Integer32s:
+        elif t is ast.Integer32s:
             return pattern.format("DevLong")
-        elif t == ast.Integer64u:
+        elif t is ast.Integer64u:
             return pattern.format("DevULong64")
-        elif t == ast.Integer64s:
+        elif t is ast.Integer64s:
             return pattern.format("DevLong64")
-        elif t == ast.Float:
+        elif t is ast.Float:
             return pattern.format("DevFloat")
 
         assert False, "{} can't be represented with any TANGO type".format(t)
 
 
-def get_extra_option(extra_options: str, option: str, get):
-    for kv in extra_options.split(","):
-        kv_list = kv.split("=", 1)
-        if len(kv_list) == 2:
-            key = kv_list[0].strip()
-            if key == option:
-                return get(kv_list[1].strip())
-        else:
-            key = kv_list[0].strip()
-            if key == option:
-                return get()
-
-    return get()
+def get_extra_option(extra_options, option: str, get):
+    # extra options are either a node's parsed options view or a raw string
+    if isinstance(extra_options, str):
+        extra_options = ast.parse_extra_options(extra_options)
+    value = extra_options.get(option)
+    return get() if value is None else get(value)
 
 
 def get_bool(default=False):
@@ -3,30 +3,29 @@ from textwrap import dedent, indent
 from zipfile import ZipFile, ZIP_DEFLATED
 
 from urpc import ast
-from urpc.builder.util.clang import split_by_type, get_argstructs, non_empty_unique_argstructs_iter, flagset_arg_iter, \
-    library_shared_file, namespace_symbol
+from urpc.builder.util.clang import analyse, library_shared_file, namespace_symbol
 from version import BUILDER_VERSION_MAJOR, BUILDER_VERSION_MINOR, BUILDER_VERSION_BUGFIX, BUILDER_VERSION_SUFFIX, \
     BUILDER_VERSION
 
 
 def _get_csharp_type(t):
-    if t == ast.Integer8u:
+    if t is ast.Integer8u:
         return "byte"
-    elif t == ast.Integer8s:
+    elif t is ast.Integer8s:
         return "sbyte"
-    elif t == ast.Integer16u:
+    elif t is ast.Integer16u:
         return "ushort"
-    elif t == ast.Integer16s:
+    elif t is ast.Integer16s:
         return "short"
-    elif t == ast.Integer32u:
+    elif t is ast.Integer32u:
         return "uint"
-    elif t == ast.Integer32s:
+    elif t is ast.Integer32s:
         return "int"
-    elif t == ast.Integer64u:
+    elif t is ast.Integer64u:
         return "ulong"
-    elif t == ast.Integer64s:
+    elif t is ast.Integer64s:
         return "long"
-    elif t == ast.Float:
+    elif t is ast.Float:
         return "float"
     elif isinstance(t, ast.Array):
         return "{}[]".format(_get_csharp_type(t.type_))
@@ -45,14 +44,13 @@ def build(protocol, out):
 
 
 def _build_file(protocol, out):
-    simple_commands, accessors = split_by_type(protocol.commands)
-    simple_commands, accessors = list(simple_commands), list(accessors)
-    argstructs = get_argstructs(simple_commands, accessors)
+    analysis = analyse(protocol)
+    argstructs = analysis.argstructs
 
     def build_flags():
         out.write(indent("[Flags] public enum Flags : uint {\n", "\t"))
         seen_consts = {}
-        for arg in flagset_arg_iter(simple_commands, accessors):
+        for arg in analysis.flagset_args:
             for const in arg.consts:
                 # HACK: implicitly assume that if const names are the same than they always have the same value
                 # The same assumption is made in C client library, but is achieved via #define behaviour
@@ -65,7 +63,7 @@ def _build_file(protocol, out):
         out.write(indent("}\n", "\t"))
 
     def build_argstructs():
-        for struct in non_empty_unique_argstructs_iter(argstructs.values()):
+        for struct in analysis.unique_argstructs:
             out.write(indent(dedent("""\
                 [StructLayout(LayoutKind.Sequential, CharSet=CharSet.Ansi)]
                 public struct {} {{
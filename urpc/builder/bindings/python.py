@@ -8,7 +8,7 @@ from inflection import camelize, underscore
 from itertools import chain
 
 from urpc import ast
-from urpc.builder.util.clang import split_by_type, get_argstructs, namespace_symbol
+from urpc.builder.util.clang import analyse, namespace_symbol
 from version import BUILDER_VERSION_MAJOR, BUILDER_VERSION_MINOR, BUILDER_VERSION_BUGFIX, BUILDER_VERSION_SUFFIX, \
     BUILDER_VERSION
 
@@ -47,23 +47,23 @@ def _get_python_type(t, for_input=False):
 
 
 def _get_python_ctype(t):
-    if t == ast.Integer8u:
+    if t is ast.Integer8u:
         return "c_ubyte"
-    elif t == ast.Integer8s:
+    elif t is ast.Integer8s:
         return "c_byte"
-    elif t == ast.Integer16u:
+    elif t is ast.Integer16u:
         return "c_ushort"
-    elif t == ast.Integer16s:
+    elif t is ast.Integer16s:
         return "c_short"
-    elif t == ast.Integer32u:
+    elif t is ast.Integer32u:
         return "c_uint"
-    elif t == ast.Integer32s:
+    elif t is ast.Integer32s:
         return "c_int"
-    elif t == ast.Integer64u:
+    elif t is ast.Integer64u:
         return "c_ulonglong"
-    elif t == ast.Integer64s:
+    elif t is ast.Integer64s:
         return "c_longlong"
-    elif t == ast.Float:
+    elif t is ast.Float:
         return "c_float"
     elif isinstance(t, ast.Array):
         return "{}*{}".format(_get_python_ctype(t.type_), len(t))
@@ -309,9 +309,9 @@ def _build_methods(protocol, simple_commands, accessors, argstructs, out):
 
 
 def _build_file(protocol, out):
-    simple_commands, accessors = split_by_type(protocol.commands)
-    simple_commands, accessors = list(simple_commands), list(accessors)
-    argstructs = get_argstructs(simple_commands, accessors)
+    analysis = analyse(protocol)
+    simple_commands, accessors = analysis.commands, analysis.accessors
+    argstructs = analysis.argstructs
 
     all_used_c_types = set()
     for command in protocol.commands:
@@ -321,9 +321,10 @@ def _build_file(protocol, out):
             else:
                 all_used_c_types.add(arg.type_)
     all_used_c_types = {_get_python_ctype(type_) for type_ in all_used_c_types}
-    c_types_str = ", ".join(all_used_c_types)
+    # sets are ordered by hashes, the output must be the same on every run
+    c_types_str = ", ".join(sorted(all_used_c_types))
     additional_required_types = {"c_void_p", "c_char_p", "c_wchar_p", "c_size_t", "c_int"} - all_used_c_types
-    add_c_types_str = ", ".join(additional_required_types)
+    add_c_types_str = ", ".join(sorted(additional_required_types))
 
     out.write(dedent("""\
         \"""
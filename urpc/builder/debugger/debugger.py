@@ -14,20 +14,12 @@ _lookup = TemplateLookup((join(_module_path, "resources"),), input_encoding="utf
 
 class DebuggerView(ClangView):
 
-    def __init__(self, project):
-        super().__init__(project)
-
-        self._setters = []
-
-        for acc in self._accessors:
-            self._setters.append(acc[1])
-
     @property
     def argstructs(self):
         return self._argstructs
 
     def is_setter(self, cmd):
-        return True if cmd in self._setters else False
+        return cmd in self._analysis.setters
 
     def build_cmake_lists(self) -> str:
         text = dedent(f"""
@@ -8,7 +8,7 @@ from zipfile import ZipFile, ZIP_DEFLATED
 from urpc import ast
 from urpc.builder.device.utils.namespaced import namespaced as namespaced_global
 from urpc.builder.documentation.sphinx.static import get_ru_static_part, get_static_part
-from urpc.builder.util.clang import split_by_type, get_argstructs
+from urpc.builder.util.clang import analyse
 from urpc.util.cconv import ascii_to_hex, get_msg_len, type_to_cstr
 from urpc.builder.documentation.common import common_path
 from version import BUILDER_VERSION
@@ -108,9 +108,9 @@ def _build_ru_file(protocol, out):
 
 
 def _build_en_file(protocol, out, namespaced):
-    simple_commands, accessors = split_by_type(protocol.commands)
-    simple_commands, accessors = list(simple_commands), list(accessors)
-    argstructs = get_argstructs(simple_commands, accessors)
+    analysis = analyse(protocol)
+    simple_commands, accessors = analysis.commands, analysis.accessors
+    argstructs = analysis.argstructs
 
     def inout(msg, argname):
         # take from base.textile.mako
@@ -13,7 +13,7 @@ from version import BUILDER_VERSION_MAJOR, BUILDER_VERSION_MINOR, BUILDER_VERSIO
 
 def _get_msg_buffer_size(msg):
     assert isinstance(msg, Message)
-    return sum(a.type_.size for a in msg.args)
+    return msg.layout.payload_size
 
 
 def _get_accessor_name(getter_or_setter_cmd):
@@ -5,16 +5,14 @@ from zipfile import ZipFile, ZIP_DEFLATED
 
 from urpc import ast
 from urpc.builder.device.utils.namespaced import namespaced as namespaced_global
-from urpc.builder.util.clang import split_by_type, get_argstructs, library_header_file
+from urpc.builder.util.clang import analyse, library_header_file
 from urpc.util.cconv import type_to_cstr
 from version import BUILDER_VERSION_MAJOR, BUILDER_VERSION_MINOR, BUILDER_VERSION_BUGFIX, BUILDER_VERSION_SUFFIX, \
     BUILDER_VERSION
 
 
 def _argstructs(protocol):
-    simple_commands, accessors = split_by_type(protocol.commands)
-    simple_commands, accessors = list(simple_commands), list(accessors)
-    return get_argstructs(simple_commands, accessors)
+    return analyse(protocol).argstructs
 
 
 def _accessor_name(cmd):
@@ -26,10 +24,7 @@ def _args(cmd):
 
 
 def _accessors(protocol):
-    _, accessors = split_by_type(protocol.commands)
-    accessors = list(accessors)
-    for getter, _ in accessors:
-        yield getter
+    yield from analyse(protocol).getters
 
 
 def _c_flags(arg, value, namespaced):
@@ -11,14 +11,12 @@ from inflection import camelize, underscore
 
 from urpc import ast
 from urpc.builder.device.utils.namespaced import namespaced as namespaced_global
-from urpc.builder.util.clang import split_by_type, get_argstructs
+from urpc.builder.util.clang import analyse
 from urpc.util.cconv import type_to_cstr
 
 
 def _argstructs(protocol):
-    simple_commands, accessors = split_by_type(protocol.commands)
-    simple_commands, accessors = list(simple_commands), list(accessors)
-    return get_argstructs(simple_commands, accessors)
+    return analyse(protocol).argstructs
 
 
 def _accessor_name(cmd):
@@ -30,10 +28,7 @@ def _args(cmd):
 
 
 def _accessors(protocol):
-    _, accessors = split_by_type(protocol.commands)
-    accessors = list(accessors)
-    for getter, _ in accessors:
-        yield getter
+    yield from analyse(protocol).getters
 
 
 def __style_flags(output, arg, value, namespaced, style="urmc"):
@@ -1,5 +1,6 @@
 from collections import OrderedDict
 from itertools import chain
+from types import MappingProxyType
 
 from urpc.util.accessor import split_by_type
 from urpc.util.cconv import type_to_cstr
@@ -109,6 +110,28 @@ def non_empty_unique_argstructs_iter(argstructs):
         yield struct
 
 
+class ProtocolAnalysis:
+    """
+    Protocol facts shared by builders: commands split by type, argument structures and flagset arguments.
+    Use analyse() to get the analysis of the current protocol revision instead of making a new one.
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.commands, self.accessors = split_by_type(protocol.commands)
+        self.command_set = frozenset(self.commands)
+        self.getters = tuple(getter for getter, _ in self.accessors)
+        self.setters = frozenset(setter for _, setter in self.accessors)
+        self.argstructs = MappingProxyType(get_argstructs(self.commands, self.accessors))
+        self.unique_argstructs = tuple(unique_argstructs_iter(self.argstructs))
+        self.flagset_args = tuple(flagset_arg_iter(self.commands, self.accessors))
+
+
+def analyse(protocol):
+    # the analysis is memoized on the protocol and dropped as soon as the protocol changes
+    return protocol.memoize(ProtocolAnalysis, lambda: ProtocolAnalysis(protocol))
+
+
 def library_shared_file(protocol):
     return protocol.name.lower()
 
@@ -131,12 +154,10 @@ class ClangView:
     def __init__(self, project):
         self._project = project
 
-        # convert from iterators to sequences
-        commands, accessors = split_by_type(project.children)
-        self._commands = list(commands)
-        self._accessors = list(accessors)
-
-        self._argstructs = get_argstructs(self._commands, self._accessors)
+        self._analysis = analyse(project)
+        self._commands = self._analysis.commands
+        self._accessors = self._analysis.accessors
+        self._argstructs = self._analysis.argstructs
 
     @property
     def version(self):
@@ -148,12 +169,12 @@ class ClangView:
 
     @property
     def flagsets(self):
-        for arg in flagset_arg_iter(self._commands, self._accessors):
+        for arg in self._analysis.flagset_args:
             yield _Flagset(arg)
 
     @property
     def argstructs(self):
-        return unique_argstructs_iter(self._argstructs)
+        return iter(self._analysis.unique_argstructs)
 
     def library_shared_file(self, protocol):
         return library_shared_file(protocol)
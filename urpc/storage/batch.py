@@ -0,0 +1,147 @@
+"""
+Batch conversion of project files without the web frontend:
+
+    python -m urpc.storage.batch -o converted -f json legacy/*.xi projects/
+
+Directories are scanned for project files. Files are loaded and saved in a pool of processes, timings and failures
+are reported per file.
+"""
+import os
+import sys
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from urpc.storage.binary import BinaryStorage
+from urpc.storage.json import JsonStorage
+from urpc.storage.oldxi import OldxiStorage
+
+# project file extension -> storage, .xi files can be loaded only
+storages = {
+    ".xi": OldxiStorage,
+    ".json": JsonStorage,
+    ".urpb": BinaryStorage,
+}
+formats = {
+    "json": ".json",
+    "binary": ".urpb",
+}
+
+Result = namedtuple("Result", ("source", "target", "load_time", "save_time", "error"))
+
+
+def _storage_for(path):
+    return storages[os.path.splitext(path)[1].lower()]()
+
+
+def convert_file(source, target):
+    """
+    Converts a single project file, storages are chosen by file extensions. Errors are reported in the result
+    instead of being raised.
+    """
+    load_time = save_time = None
+    try:
+        start = perf_counter()
+        with open(source, "rb") as f:
+            protocol = _storage_for(source).load(f)
+        load_time = perf_counter() - start
+
+        start = perf_counter()
+        # a failed conversion doesn't leave a partial file behind
+        with open(target + ".tmp", "wb") as f:
+            _storage_for(target).save(protocol, f)
+        os.replace(target + ".tmp", target)
+        save_time = perf_counter() - start
+    except Exception as e:
+        if os.path.exists(target + ".tmp"):
+            os.remove(target + ".tmp")
+        return Result(source, target, load_time, save_time, "{}: {}".format(type(e).__name__, e))
+    return Result(source, target, load_time, save_time, None)
+
+
+def _convert_pair(pair):
+    return convert_file(*pair)
+
+
+def find_projects(paths):
+    """
+    Lists project files given as is or found in the given directories.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if os.path.splitext(name)[1].lower() in storages:
+                    yield os.path.join(root, name)
+
+
+def convert(sources, target_dir=None, target_format="json", jobs=None):
+    """
+    Converts project files into target_dir, next to the sources if it is not given. Files are converted by jobs
+    processes, as many as there are CPUs by default. Yields results in the order of the sources.
+    """
+    extension = formats[target_format]
+    # failures are kept by position, the same file may be listed twice and only the second one fails then
+    pairs, failed, targets = [], {}, set()
+    for source in sources:
+        target = os.path.join(target_dir or os.path.dirname(source), os.path.splitext(os.path.basename(source))[0])
+        target += extension
+        if os.path.splitext(source)[1].lower() not in storages:
+            failed[len(pairs)] = "unknown project file type"
+        elif os.path.abspath(target) in targets:
+            failed[len(pairs)] = "target {} is shared with another file".format(target)
+        elif os.path.abspath(target) == os.path.abspath(source):
+            failed[len(pairs)] = "the file is already in the target format"
+        targets.add(os.path.abspath(target))
+        pairs.append((source, target))
+
+    if target_dir:
+        os.makedirs(target_dir, exist_ok=True)
+
+    todo = [pair for i, pair in enumerate(pairs) if i not in failed]
+    pool = None if jobs == 1 or len(todo) < 2 else ProcessPoolExecutor(jobs)
+    try:
+        # files are sent one by one, their sizes differ too much to be balanced in chunks
+        converted = (pool.map if pool else map)(_convert_pair, todo)
+        for i, (source, target) in enumerate(pairs):
+            if i in failed:
+                yield Result(source, target, None, None, failed[i])
+            else:
+                yield next(converted)
+    finally:
+        if pool:
+            pool.shutdown()
+
+
+def _seconds(value):
+    return "-" if value is None else "{:.3f}s".format(value)
+
+
+def main(argv=None):
+    parser = ArgumentParser(prog="python -m urpc.storage.batch", description="Converts uRPC project files.")
+    parser.add_argument("paths", nargs="+", help="project files and directories with them")
+    parser.add_argument("-o", "--output", help="output directory, files are saved next to the sources by default")
+    parser.add_argument("-f", "--format", choices=sorted(formats), default="json", help="target format")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of processes, CPU count by default")
+    args = parser.parse_args(argv)
+
+    total, failures = 0, 0
+    start = perf_counter()
+    for result in convert(find_projects(args.paths), args.output, args.format, args.jobs):
+        total += 1
+        if result.error:
+            failures += 1
+            print("FAILED {}: {}".format(result.source, result.error))
+        else:
+            print("ok     {} -> {} (load {}, save {})".format(
+                result.source, result.target, _seconds(result.load_time), _seconds(result.save_time)
+            ))
+    print("{} converted, {} failed in {}".format(total - failures, failures, _seconds(perf_counter() - start)))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,538 @@
+import mmap
+import os
+from contextlib import contextmanager
+from itertools import accumulate, chain
+from uuid import UUID
+
+from urpc import ast
+from urpc.storage.util import gc_paused
+
+# Compact binary project format. All integers are unsigned LEB128 varints unless stated otherwise.
+#
+#   header       magic, format version, flags
+#   strings      count, length of every string in characters, UTF-8 byte length of all strings, all strings
+#   shapes       deduplicated projects only: count, byte length and content of every shape
+#   protocol     name, version, extra options, description, uid, commands count, commands
+#   command      byte length of the rest of the record, cid, name, extra options, description, uid,
+#                request, response
+#   message      byte length of the rest of the record, extra options, description, uid, fingerprint,
+#                arguments count, arguments
+#   argument     name, type, extra options, description, uid, constants count, constants
+#   constant     name, value (zigzag encoded), extra options, description, uid
+#
+# Strings are stored once and referred to by their index. Uids and fingerprints are 16 raw bytes. A type is a single
+# byte code, arrays have the array bit set and are followed by the length. A description is a count of language
+# and text pairs, zero for an empty one. Commands and messages are prefixed with their length, so lazy loading
+# decodes command headers only and skips the rest until it is accessed. Stored fingerprints let accessors be
+# matched without decoding the arguments, they must be in line with AstNode.fingerprint.
+#
+# Deduplicated projects store every distinct message and constants list once as a shape: the content of a message
+# (or constants count and constants) without uids. A message record holds the index of its shape followed by uids
+# of the message and its descendants in preorder, an argument holds the index of the shape of its constants instead
+# of them. Accessor getter responses and setter requests share shapes, same as repeated flag sets, while every node
+# keeps its own uid. Version 1 has neither flags nor shapes.
+#
+# Changes of a protocol (see Protocol.journal) are encoded separately from projects, each one with its own strings:
+#
+#   change       strings, operation code, path length, path, uid, arguments of the operation
+#   set          key, value kind, value: a string, an integer (zigzag encoded) or a type
+#   unset        key
+#   describe     description
+#   options      extra options
+#   insert       index, node kind, node
+#   delete       index
+#   replace      index, node kind, node
+#
+# The path holds child indices leading from the protocol to the changed node, the uid of the node is checked against
+# the node found by the path.
+
+_magic = b"uRPB"
+# Bump on any layout change, older versions should still be read
+_version = 2
+# header flags
+_deduplicated = 0x1
+
+_types = (
+    ast.Integer8u, ast.Integer8s, ast.Integer16u, ast.Integer16s, ast.Integer32u, ast.Integer32s,
+    ast.Integer64u, ast.Integer64s, ast.Float
+)
+_type_codes = {t: code for code, t in enumerate(_types)}
+_array_bit = 0x80
+
+_empty_description = {code: "" for code in ast.AstNode.Description.codes}
+
+_operations = ("set", "unset", "describe", "options", "insert", "delete", "replace")
+_operation_codes = {operation: code for code, operation in enumerate(_operations)}
+_value_kinds = (str, int, ast.FieldType)
+_node_kinds = (ast.FlagConstant, ast.Argument, ast.Message, ast.Command)
+_node_kind_codes = {kind: code for code, kind in enumerate(_node_kinds)}
+
+
+class _Encoder:
+    def __init__(self, dedupe=False):
+        self._strings = {}
+        self._out = bytearray()
+        # shape -> its index, for deduplicated projects only
+        self._shapes = {} if dedupe else None
+        # uids of the message encoded as a shape
+        self._uids = None
+
+    def _uint(self, value):
+        out = self._out
+        while value >= 0x80:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+
+    def _int(self, value):
+        self._uint(value << 1 if value >= 0 else (-value << 1) - 1)
+
+    def _str(self, value):
+        index = self._strings.get(value)
+        if index is None:
+            index = self._strings[value] = len(self._strings)
+        self._uint(index)
+
+    def _type(self, type_):
+        if isinstance(type_, ast.ArrayType):
+            self._out.append(_type_codes[type_.type_] | _array_bit)
+            self._uint(len(type_))
+        else:
+            self._out.append(_type_codes[type_])
+
+    def _description(self, description):
+        if description == _empty_description:
+            self._uint(0)
+        else:
+            self._uint(len(description))
+            for lang, text in description.items():
+                self._str(lang)
+                self._str(text)
+
+    def _common(self, node):
+        self._str(node.extra_options)
+        self._description(dict(node._description))
+        if self._uids is None:
+            self._out += node.uid.bytes
+        else:
+            self._uids += node.uid.bytes
+
+    def _constant(self, const):
+        self._str(const.name)
+        self._int(const.value)
+        self._common(const)
+
+    def _argument(self, arg):
+        self._str(arg.name)
+        self._type(arg.type_)
+        self._common(arg)
+        if self._shapes is None:
+            self._constants(arg.consts)
+        else:
+            self._shape(self._constants, arg.consts)
+
+    def _constants(self, consts):
+        self._uint(len(consts))
+        for const in consts:
+            self._constant(const)
+
+    def _message_body(self, msg):
+        self._common(msg)
+        self._out += msg.fingerprint
+        self._uint(len(msg.args))
+        for arg in msg.args:
+            self._argument(arg)
+
+    def _message(self, msg):
+        if self._shapes is None:
+            self._message_body(msg)
+            return
+        self._uids = bytearray()
+        self._shape(self._message_body, msg)
+        self._out += self._uids
+        self._uids = None
+
+    # writes index of the shape of nodes encoded by encode(), the shape is stored once
+    def _shape(self, encode, nodes):
+        body, self._out = self._out, bytearray()
+        encode(nodes)
+        shape, self._out = bytes(self._out), body
+        index = self._shapes.get(shape)
+        if index is None:
+            index = self._shapes[shape] = len(self._shapes)
+        self._uint(index)
+
+    def _record(self, encode, node):
+        body, self._out = self._out, bytearray()
+        encode(node)
+        record, self._out = self._out, body
+        self._uint(len(record))
+        self._out += record
+
+    def _command(self, cmd):
+        self._str(cmd.cid)
+        self._str(cmd.name)
+        self._common(cmd)
+        self._record(self._message, cmd.request)
+        self._record(self._message, cmd.response)
+
+    def _value(self, value):
+        for kind, cls in enumerate(_value_kinds):
+            if isinstance(value, cls) and not isinstance(value, bool):
+                break
+        else:
+            raise ValueError("Unsupported property value {!r}".format(value))
+        self._out.append(kind)
+        if cls is str:
+            self._str(value)
+        elif cls is int:
+            self._int(value)
+        else:
+            self._type(value)
+
+    def _node(self, node):
+        self._out.append(_node_kind_codes[type(node)])
+        if isinstance(node, ast.FlagConstant):
+            self._constant(node)
+        elif isinstance(node, ast.Argument):
+            self._argument(node)
+        else:
+            self._record(self._message if isinstance(node, ast.Message) else self._command, node)
+
+    def change(self, operation, path, uid, args):
+        self._out.append(_operation_codes[operation])
+        self._uint(len(path))
+        for index in path:
+            self._uint(index)
+        self._out += uid.bytes
+        if operation == "set":
+            self._str(args[0])
+            self._value(args[1])
+        elif operation == "unset":
+            self._str(args[0])
+        elif operation == "describe":
+            self._description(args[0])
+        elif operation == "options":
+            self._str(args[0])
+        else:
+            self._uint(args[0])
+            if operation != "delete":
+                self._node(args[1])
+
+        body, self._out = self._out, bytearray()
+        self._strings_table()
+        return bytes(self._out + body)
+
+    def encode(self, protocol, output):
+        self._str(protocol.name)
+        self._str(protocol.version)
+        self._common(protocol)
+        self._uint(len(protocol.commands))
+        for cmd in protocol.commands:
+            self._record(self._command, cmd)
+
+        body, self._out = self._out, bytearray(_magic)
+        self._uint(_version)
+        self._uint(0 if self._shapes is None else _deduplicated)
+        self._strings_table()
+        if self._shapes is not None:
+            self._uint(len(self._shapes))
+            for shape in self._shapes:
+                self._uint(len(shape))
+                self._out += shape
+        output.write(self._out)
+        output.write(body)
+
+    def _strings_table(self):
+        self._uint(len(self._strings))
+        # dictionaries keep insertion order, which is the order of indices
+        for string in self._strings:
+            self._uint(len(string))
+        blob = "".join(self._strings).encode("utf-8")
+        self._uint(len(blob))
+        self._out += blob
+
+
+# Decoding errors of truncated or garbled input are reported the same way as malformed records
+@contextmanager
+def _decoding():
+    try:
+        with gc_paused():
+            yield
+    except (IndexError, UnicodeDecodeError):
+        raise ValueError("Corrupted binary project")
+
+
+def _map(_input):
+    # mapped files can't be replaced on Windows, they are read there
+    if os.name != "nt":
+        try:
+            if _input.tell() == 0:
+                return mmap.mmap(_input.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            pass
+    return _input.read()
+
+
+class _Decoder:
+    def __init__(self, data, strings=None, pos=0, shapes=None, uids=None):
+        self._data = data
+        self._pos = pos
+        self._strings = strings
+        # positions of shapes, for deduplicated projects only
+        self._shapes = shapes
+        # position of uids of the message decoded from a shape
+        self._uids = uids
+
+    def _uint(self):
+        data, pos = self._data, self._pos
+        byte = data[pos]
+        pos += 1
+        # most of the values are string indices and counts fitting a byte
+        if byte < 0x80:
+            self._pos = pos
+            return byte
+        value, shift = byte & 0x7f, 7
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        self._pos = pos
+        return value
+
+    def _int(self):
+        value = self._uint()
+        return -((value + 1) >> 1) if value & 1 else value >> 1
+
+    def _str(self):
+        return self._strings[self._uint()]
+
+    def _raw(self, length):
+        start = self._pos
+        self._pos += length
+        if self._pos > len(self._data):
+            raise ValueError("Truncated binary project")
+        return bytes(self._data[start:self._pos])
+
+    def _uid(self):
+        if self._uids is None:
+            return UUID(bytes=self._raw(16))
+        start = self._uids
+        self._uids += 16
+        if self._uids > len(self._data):
+            raise ValueError("Truncated binary project")
+        return UUID(bytes=bytes(self._data[start:self._uids]))
+
+    # reads length prefix of a record, returns position of the record end
+    def _record_end(self):
+        length = self._uint()
+        return self._pos + length
+
+    def _check_end(self, end):
+        if self._pos != end:
+            raise ValueError("Malformed binary project record")
+
+    # decodes count nodes with decode() from the current position once called
+    def _loader(self, decode, count):
+        data, strings, pos, shapes, uids = self._data, self._strings, self._pos, self._shapes, self._uids
+
+        def load():
+            decoder = _Decoder(data, strings, pos, shapes, uids)
+            with _decoding():
+                return [decode(decoder) for _ in range(count)]
+        return load
+
+    def _type(self):
+        code = self._data[self._pos]
+        self._pos += 1
+        type_ = _types[code & ~_array_bit]
+        return ast.ArrayType(type_, self._uint()) if code & _array_bit else type_
+
+    def _description(self):
+        count = self._uint()
+        return dict((self._str(), self._str()) for _ in range(count)) if count else None
+
+    def _common(self):
+        extra_options = self._str()
+        description = self._description()
+        if description is not None:
+            description = ast.AstNode.Description(**description)
+        return extra_options, description, self._uid()
+
+    def _constant(self):
+        name, value = self._str(), self._int()
+        extra_options, description, uid = self._common()
+        return ast.FlagConstant(name, value, description, extra_options, uid=uid)
+
+    def _argument(self):
+        name, type_ = self._str(), self._type()
+        extra_options, description, uid = self._common()
+        if self._shapes is None:
+            consts = self._constants()
+        else:
+            consts = self._from_shape(_Decoder._constants)
+        return ast.Argument(type_, name, description, consts, extra_options, uid=uid)
+
+    def _constants(self):
+        return [self._constant() for _ in range(self._uint())]
+
+    # decodes the shape referred to at the current position with decode()
+    def _from_shape(self, decode):
+        index = self._uint()
+        pos, self._pos = self._pos, self._shapes[index]
+        nodes = decode(self)
+        self._pos = pos
+        return nodes
+
+    # moves to the shape of the message the record refers to, uids follow the shape index in the record
+    def _enter_message_shape(self):
+        if self._shapes is not None:
+            index = self._uint()
+            self._uids, self._pos = self._pos, self._shapes[index]
+
+    def _leave_message_shape(self, end):
+        if self._shapes is not None:
+            self._pos, self._uids = self._uids, None
+        self._check_end(end)
+
+    def _message(self):
+        end = self._record_end()
+        self._enter_message_shape()
+        extra_options, description, uid = self._common()
+        # the fingerprint is computed anew once needed
+        self._pos += 16
+        args = [self._argument() for _ in range(self._uint())]
+        self._leave_message_shape(end)
+        return ast.Message(args, description, extra_options, uid=uid)
+
+    def _lazy_message(self):
+        end = self._record_end()
+        self._enter_message_shape()
+        extra_options, description, uid = self._common()
+        fingerprint = self._raw(16)
+        count = self._uint()
+        load = self._loader(_Decoder._argument, count)
+        self._pos, self._uids = end, None
+        return ast.Message._lazy(None, count, load, description, extra_options, uid, fingerprint)
+
+    def _command(self, lazy=False):
+        end = self._record_end()
+        cid, name = self._str(), self._str()
+        extra_options, description, uid = self._common()
+        if lazy:
+            load = self._loader(_Decoder._lazy_message, 2)
+            self._pos = end
+            return ast.Command._lazy({"cid": cid, "name": name}, 2, load, description, extra_options, uid)
+
+        request, response = self._message(), self._message()
+        self._check_end(end)
+        return ast.Command(cid, name, request, response, description, extra_options, uid=uid)
+
+    def _header(self):
+        if self._raw(len(_magic)) != _magic:
+            raise ValueError("Not a binary project")
+        version = self._uint()
+        if version not in (1, _version):
+            raise ValueError("Unsupported binary project version {}".format(version))
+        flags = self._uint() if version > 1 else 0
+        self._strings_table()
+        if flags & _deduplicated:
+            self._shapes = []
+            for _ in range(self._uint()):
+                end = self._record_end()
+                self._shapes.append(self._pos)
+                self._pos = end
+
+    def _strings_table(self):
+        ends = list(accumulate(self._uint() for _ in range(self._uint())))
+        blob = self._raw(self._uint()).decode("utf-8")
+        if (ends[-1] if ends else 0) != len(blob):
+            raise ValueError("Malformed binary project strings")
+        self._strings = [blob[start:end] for start, end in zip(chain((0,), ends), ends)]
+
+    def _value(self):
+        kind = self._data[self._pos]
+        self._pos += 1
+        cls = _value_kinds[kind]
+        if cls is str:
+            return self._str()
+        elif cls is int:
+            return self._int()
+        return self._type()
+
+    def _node(self):
+        kind = _node_kinds[self._data[self._pos]]
+        self._pos += 1
+        if kind is ast.FlagConstant:
+            return self._constant()
+        elif kind is ast.Argument:
+            return self._argument()
+        elif kind is ast.Message:
+            return self._message()
+        return self._command()
+
+    def change(self):
+        self._strings_table()
+        operation = _operations[self._data[self._pos]]
+        self._pos += 1
+        path = [self._uint() for _ in range(self._uint())]
+        uid = UUID(bytes=self._raw(16))
+        if operation == "set":
+            args = (self._str(), self._value())
+        elif operation == "describe":
+            args = (self._description() or dict(_empty_description),)
+        elif operation in ("unset", "options"):
+            args = (self._str(),)
+        elif operation == "delete":
+            args = (self._uint(),)
+        else:
+            args = (self._uint(), self._node())
+        if self._pos != len(self._data):
+            raise ValueError("Malformed change record")
+        return operation, path, uid, args
+
+    def decode(self, lazy=False):
+        self._header()
+        name, version = self._str(), self._str()
+        extra_options, _, uid = self._common()
+        commands = [self._command(lazy) for _ in range(self._uint())]
+        return ast.Protocol(name, version, commands, extra_options, uid)
+
+
+def encode_change(operation, path, uid, args):
+    """
+    Encodes a change of a protocol, see the format description above. Raises ValueError for values which can't
+    be stored.
+    """
+    return _Encoder().change(operation, path, uid, args)
+
+
+def decode_change(data):
+    """
+    Decodes a change encoded by encode_change(), returns (operation, path, uid, args).
+    """
+    with _decoding():
+        return _Decoder(data).change()
+
+
+class BinaryStorage:
+    def save(self, protocol, output, dedupe=False):
+        """
+        Deduplicated projects store every distinct message and constants list once, which shrinks projects having
+        many accessors or repeated flag sets. Loading them costs the same.
+        """
+        _Encoder(dedupe).encode(protocol, output)
+
+    def load(self, _input, lazy=False):
+        """
+        Lazy loading decodes only command headers, messages and arguments are decoded on the first access to them.
+        The input is memory mapped if possible, so the file must not be overwritten while the project is in use.
+        """
+        data = _map(_input) if lazy else _input.read()
+        with _decoding():
+            return _Decoder(data).decode(lazy)
+
+    def init(self):
+        # Empty function for flake8
+        return None
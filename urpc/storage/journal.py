@@ -0,0 +1,146 @@
+from hashlib import blake2b
+from struct import Struct
+
+from urpc.storage.binary import decode_change, encode_change
+
+# Journal of changes made to a protocol since its binary snapshot was saved:
+#
+#   header       magic, digest of the snapshot the journal continues
+#   records      byte length of the change (4 bytes, little endian), change encoded by encode_change()
+#
+# Records are appended as changes are made and aren't rewritten. A record torn by a crash is dropped on replay.
+
+_magic = b"uRPJ"
+_length = Struct("<I")
+_digest_size = 16
+
+
+def digest(snapshot):
+    """
+    Identifies a snapshot, so a journal isn't replayed onto a snapshot it doesn't continue.
+    """
+    return blake2b(snapshot, digest_size=_digest_size).digest()
+
+
+# child indices leading from the protocol to the node
+def _path(node):
+    path = []
+    while node.parent is not None:
+        path.append(node.parent.children.index(node))
+        node = node.parent
+    path.reverse()
+    return path
+
+
+def header(base):
+    """
+    Starts a journal continuing the snapshot with the given digest.
+    """
+    return _magic + base
+
+
+class Journal:
+    """
+    Append-only file of changes of a protocol, see Protocol.journal. Every change is written once made, so storing
+    an edit costs as much as the edit rather than as the whole protocol. A change which can't be written fails
+    the journal and the rest of changes are not recorded: the protocol has to be saved anew then.
+
+    The file is anything having write(), flush(), tell() and close() of binary files, placed after the header or
+    the records replayed, see replay(). A journal made without a file keeps changes in memory until start() is
+    called: changes go on being recorded while the snapshot the journal continues is saved.
+    """
+
+    def __init__(self, file=None):
+        self._file = file
+        self._buffer = bytearray() if file is None else None
+        self.failed = False
+
+    def start(self, file):
+        """
+        Continues the journal in the file, changes recorded so far included.
+        """
+        if self._buffer:
+            file.write(self._buffer)
+            file.flush()
+        self._file, self._buffer = file, None
+
+    @property
+    def size(self):
+        if self._file is None:
+            return len(_magic) + _digest_size + len(self._buffer)
+        return self._file.tell()
+
+    def record(self, operation, node, *args):
+        if self.failed:
+            return
+        try:
+            change = encode_change(operation, _path(node), node.uid, args)
+            if self._file is None:
+                self._buffer += _length.pack(len(change)) + change
+                return
+            self._file.write(_length.pack(len(change)) + change)
+            # a crashed process loses nothing, the system may still lose the tail
+            self._file.flush()
+        except (OSError, ValueError):
+            self.failed = True
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def _attached(node, value):
+    # a child put in place of another one is still listed at its former place amid a swap, so it is reused rather
+    # than copied
+    for child in node.children:
+        if child.uid == value.uid:
+            return child
+    return value
+
+
+def _apply(protocol, operation, path, uid, args):
+    node = protocol
+    try:
+        for index in path:
+            node = node.children[index]
+    except IndexError:
+        node = None
+    if node is None or node.uid != uid:
+        raise ValueError("Journal doesn't match the project")
+
+    if operation == "set":
+        node.props[args[0]] = args[1]
+    elif operation == "unset":
+        del node.props[args[0]]
+    elif operation == "describe":
+        for lang in set(node.description) - set(args[0]):
+            del node.description[lang]
+        for lang, text in args[0].items():
+            node.description[lang] = text
+    elif operation == "options":
+        node.extra_options = args[0]
+    elif operation == "insert":
+        node.children.insert(*args)
+    elif operation == "delete":
+        del node.children[args[0]]
+    else:
+        node.children[args[0]] = _attached(node, args[1])
+
+
+def replay(protocol, data, base):
+    """
+    Applies journal data to the protocol loaded from the snapshot with the given digest. Returns the length of
+    the data applied to continue the journal from, or None if the journal continues another snapshot: such one
+    is left behind when saving a snapshot is interrupted and its changes are in the snapshot already.
+    """
+    start = header(base)
+    if data[:len(start)] != start:
+        return None
+    pos = len(start)
+    while pos + _length.size <= len(data):
+        end = pos + _length.size + _length.unpack_from(data, pos)[0]
+        if end > len(data):
+            break
+        _apply(protocol, *decode_change(data[pos + _length.size:end]))
+        pos = end
+    return pos
@@ -1,10 +1,14 @@
-import re
+import os
 from io import TextIOWrapper
+from json import loads
+from json.encoder import encode_basestring
 from uuid import UUID
 
-from marshmallow import fields, Schema, post_load
+from marshmallow import fields, Schema, ValidationError, post_load
 
 from urpc import ast
+from urpc.storage.util import gc_paused
+from urpc.util import typecodec
 
 
 class TypeField(fields.Field):
@@ -12,50 +16,14 @@ class TypeField(fields.Field):
         # Because "type" is keyword in Python, we will use other variable name
         super(TypeField, self).__init__(dump_to="type", load_from="type")
 
-    # TODO: replace with dconv
-    def _from_base_type(self, type_obj):
-        if isinstance(type_obj, ast.IntegerType):
-            return ("" if type_obj.signed else "u") + "int" + str(type_obj.size * 8)
-        elif isinstance(type_obj, ast.FloatType):
-            return "float"
-
-    def _from_type(self, type_obj):
-        if isinstance(type_obj, ast.ArrayType):
-            return self._from_base_type(type_obj.type_) + "[{}]".format(len(type_obj))
-        else:
-            return self._from_base_type(type_obj)
-
     def _serialize(self, value, attr, obj):
-        return self._from_type(value)
-
-    def _to_base_type(self, type_str):
-        if type_str == "float":
-            return ast.Float
-        elif type_str == "int64":
-            return ast.Integer64s
-        elif type_str == "uint64":
-            return ast.Integer64u
-        elif type_str == "int32":
-            return ast.Integer32s
-        elif type_str == "uint32":
-            return ast.Integer32u
-        elif type_str == "int16":
-            return ast.Integer16s
-        elif type_str == "uint16":
-            return ast.Integer16u
-        elif type_str == "uint8":
-            return ast.Integer8u
-        elif type_str == "int8":
-            return ast.Integer8s
-        raise ValueError("wrong int size")
+        return typecodec.format_json(value)
 
     def _deserialize(self, value, attr, data):
-        parsed = re.search(r"(?P<type>[u]?int[1-9]+?|float)(?:\[(?P<length>[0-9]+?)\])?$", data["type"])
-
-        base_type = self._to_base_type(parsed.group("type"))
-        length = parsed.group("length") or False
-
-        return ast.ArrayType(base_type, int(length)) if length else base_type
+        try:
+            return typecodec.parse_json(data["type"])
+        except ValueError:
+            raise ValidationError("Not a valid type.")
 
 
 class DescriptionField(fields.Field):
@@ -146,24 +114,229 @@ class ProtocolSchema(Schema):
         return protocol
 
 
+# Direct decoder of JSON documents into AST. It follows the schemas above in a single pass: unknown keys are ignored,
+# missing optional keys are left to AST defaults, nulls and values of wrong types are errors, and nodes are built
+# with the same arguments the schemas pass.
+
+_missing = object()
+
+
+def _fail(path, message):
+    raise ValueError("{}: {}".format(path, message))
+
+
+def _string(value, path):
+    if not isinstance(value, str):
+        _fail(path, "Not a valid string.")
+    return value
+
+
+def _integer(value, path):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        _fail(path, "Not a valid integer.")
+
+
+def _uuid(value, path):
+    if not isinstance(value, str):
+        _fail(path, "Not a valid UUID.")
+    try:
+        return UUID(value)
+    except ValueError:
+        _fail(path, "Not a valid UUID.")
+
+
+def _description(value, path):
+    if not isinstance(value, dict):
+        _fail(path, "Invalid type.")
+    for lang, text in value.items():
+        if lang not in ast.AstNode.Description.codes:
+            _fail("{}.{}".format(path, lang), "Unknown language.")
+        _string(text, "{}.{}".format(path, lang))
+    return ast.AstNode.Description(**{k: v.replace("\r", "") for k, v in value.items()})
+
+
+def _type(value, path):
+    # type strings are hashed for the cache, so check them first
+    try:
+        return typecodec.parse_json(_string(value, path))
+    except ValueError:
+        _fail(path, "Not a valid type.")
+
+
+def _nested(decode):
+    def convert(value, path):
+        return decode(value, path + ".")
+    return convert
+
+
+def _nested_many(decode):
+    def convert(value, path):
+        if not isinstance(value, list):
+            _fail(path, "Invalid type.")
+        return [decode(item, "{}.{}.".format(path, i)) for i, item in enumerate(value)]
+    return convert
+
+
+def _node(cls, spec):
+    def decode(data, path=""):
+        if not isinstance(data, dict):
+            _fail(path.rstrip(".") or "_schema", "Invalid input type.")
+        kwargs = {}
+        for key, name, convert, required in spec:
+            value = data.get(key, _missing)
+            if value is _missing:
+                if required:
+                    _fail(path + key, "Missing data for required field.")
+                continue
+            if value is None:
+                _fail(path + key, "Field may not be null.")
+            kwargs[name] = convert(value, path + key)
+        return cls(**kwargs)
+    return decode
+
+
+_common_spec = (
+    ("description", "description", _description, False),
+    ("extra_options", "extra_options", _string, False),
+    ("uid", "uid", _uuid, True),
+)
+_decode_constant = _node(ast.FlagConstant, (
+    ("name", "name", _string, False),
+    ("value", "value", _integer, False),
+) + _common_spec)
+_decode_argument = _node(ast.Argument, (
+    ("name", "name", _string, False),
+    ("type", "type_", _type, False),
+    ("consts", "consts", _nested_many(_decode_constant), False),
+) + _common_spec)
+_decode_message = _node(ast.Message, (
+    ("args", "args", _nested_many(_decode_argument), False),
+) + _common_spec)
+_decode_command = _node(ast.Command, (
+    ("name", "name", _string, False),
+    ("cid", "cid", _string, False),
+    ("request", "request", _nested(_decode_message), False),
+    ("response", "response", _nested(_decode_message), False),
+) + _common_spec)
+_decode_protocol = _node(ast.Protocol, (
+    ("name", "name", _string, False),
+    ("version", "version", _string, False),
+    ("project_name", "project_name", _string, False),
+    ("commands", "commands", _nested_many(_decode_command), False),
+    ("extra_options", "extra_options", _string, False),
+    ("uid", "uid", _uuid, True),
+))
+
+
+# Streaming encoder of AST into JSON documents. Nodes are turned into the same fields the schemas dump one at a time,
+# so only the path to the current node is held in memory. Pretty output is the same as json.dumps() with indent=2 and
+# sorted keys gives, compact output has no whitespace at all.
+
+def _common_fields(node):
+    return (
+        ("description", {lang: text.replace("\r", "") for lang, text in node._description.items()}),
+        ("extra_options", node.extra_options),
+        ("uid", str(node.uid)),
+    )
+
+
+def _node_fields(node):
+    if isinstance(node, ast.Argument):
+        fields_ = (("consts", list(node.consts)), ("name", node.name), ("type", typecodec.format_json(node.type_)))
+    elif isinstance(node, ast.Message):
+        fields_ = (("args", list(node.args)),)
+    elif isinstance(node, ast.Command):
+        fields_ = (("cid", node.cid), ("name", node.name), ("request", node.request), ("response", node.response))
+    elif isinstance(node, ast.FlagConstant):
+        fields_ = (("name", node.name), ("value", int(node.value)))
+    else:
+        assert isinstance(node, ast.Protocol)
+        return sorted((
+            ("commands", list(node.commands)), ("extra_options", node.extra_options), ("name", node.name),
+            ("uid", str(node.uid)), ("version", node.version)
+        ))
+    return sorted(fields_ + _common_fields(node))
+
+
+class _StreamEncoder:
+    def __init__(self, compact):
+        self._indent = None if compact else "  "
+        self._key_separator = ":" if compact else ": "
+
+    def _newline(self, level):
+        # text output used to translate line breaks
+        return "" if self._indent is None else os.linesep + self._indent * level
+
+    def _items(self, opening, items, closing, level):
+        if not items:
+            yield opening + closing
+            return
+        newline = self._newline(level + 1)
+        separator = "," + newline
+        yield opening + newline
+        for i, (key, value) in enumerate(items):
+            if i:
+                yield separator
+            if key is not None:
+                yield encode_basestring(key) + self._key_separator
+            yield from self.iterencode(value, level + 1)
+        yield self._newline(level) + closing
+
+    def iterencode(self, value, level=0):
+        if isinstance(value, str):
+            yield encode_basestring(value)
+        elif value is None:
+            yield "null"
+        elif isinstance(value, int):
+            yield int.__repr__(value)
+        elif isinstance(value, ast.AstNode):
+            yield from self._items("{", _node_fields(value), "}", level)
+        elif isinstance(value, dict):
+            yield from self._items("{", sorted(value.items()), "}", level)
+        else:
+            yield from self._items("[", [(None, item) for item in value], "]", level)
+
+
 class JsonStorage:
     def __init__(self):
         self._schema = ProtocolSchema()
 
-    def save(self, protocol, output):
-        data, errors = self._schema.dumps(protocol, ensure_ascii=False, indent=2, sort_keys=True)
-        if len(errors):
-            raise ValueError(errors)
-        text_output = TextIOWrapper(output, encoding="utf-8")
-        text_output.write(data)
-        text_output.flush()
-        text_output.detach()
-
-    def load(self, _input):
+    # Streams UTF-8 encoded document into the binary output. Compact mode skips whitespace, the reference mode
+    # dumps through marshmallow schemas and makes the same output as the pretty one.
+    def save(self, protocol, output, compact=False, reference=False):
+        if reference:
+            data, errors = self._schema.dumps(protocol, ensure_ascii=False, indent=2, sort_keys=True)
+            if len(errors):
+                raise ValueError(errors)
+            text_output = TextIOWrapper(output, encoding="utf-8")
+            text_output.write(data)
+            text_output.flush()
+            text_output.detach()
+            return
+
+        chunks, size = [], 0
+        for chunk in _StreamEncoder(compact).iterencode(protocol):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= 65536:
+                output.write("".join(chunks).encode("utf-8"))
+                chunks, size = [], 0
+        output.write("".join(chunks).encode("utf-8"))
+
+    # The reference mode loads through marshmallow schemas, it is much slower but reports all errors at once
+    def load(self, _input, reference=False):
         text_input = TextIOWrapper(_input, encoding="utf-8")
-        protocol, errors = self._schema.loads(text_input.read())
+        text = text_input.read()
         text_input.flush()
         text_input.detach()
+
+        if not reference:
+            with gc_paused():
+                return _decode_protocol(loads(text))
+
+        protocol, errors = self._schema.loads(text)
         if len(errors):
             raise ValueError(errors)
 
@@ -1,57 +1,25 @@
-from pyparsing import Each, Suppress, Optional, ZeroOrMore, Or, CaselessLiteral, \
+import re
+
+from pyparsing import Each, Suppress, Optional, ZeroOrMore, \
     Word, ParseException, Group, QuotedString, \
-    OneOrMore
+    OneOrMore, Token
 from pyparsing import nums
 
 from urpc.storage.oldxi import ast, doxygen
-import urpc.ast.types as ast_base
-from urpc.storage.oldxi.common import identifier, exclude_attributes, include_attributes
-
-
-def _build_ctype():
-    tlist = (
-        "int64s", "int64u", "int32s", "int32u", "int16u", "int16s", "int8u", "int8s",
-        "cdfloat", "cfloat", "float", "double", "char", "byte"
-    )
-    types = Or(CaselessLiteral(s) for s in tlist)
-    return types
-
-
-_ctype = _build_ctype()
+from urpc.storage.oldxi.common import identifier, exclude_attributes, include_attributes, keywords, \
+    identifier_pattern, blank_pattern
+from urpc.util import typecodec
+
+_ctype_names = (
+    "int64s", "int64u", "int32s", "int32u", "int16u", "int16s", "int8u", "int8s",
+    "cdfloat", "cfloat", "float", "double", "char", "byte"
+)
+_ctype = keywords(_ctype_names, caseless=True)
 _array = Optional(Suppress("[") + Word(nums) + Suppress("]"))
 
 
 def str2ast_type(type_str, type_len=None):
-    def extract_base_type(type_str):
-        if type_str == "cdfloat":
-            return ast_base.Float
-        if type_str == "cfloat":
-            return ast_base.Float
-        if type_str == "float":
-            return ast_base.Float
-        elif type_str == "int64s":
-            return ast_base.Integer64s
-        elif type_str == "int64u":
-            return ast_base.Integer64u
-        elif type_str == "int32s":
-            return ast_base.Integer32s
-        elif type_str == "int32u":
-            return ast_base.Integer32u
-        elif type_str == "int16u":
-            return ast_base.Integer16u
-        elif type_str == "int16s":
-            return ast_base.Integer16s
-        elif type_str == "int8u" or type_str == "byte":
-            return ast_base.Integer8u
-        elif type_str == "int8s" or type_str == "char":
-            return ast_base.Integer8s
-        else:
-            raise ValueError("Wrong C type supplied")
-
-    base_type = extract_base_type(type_str)
-    if type_len:
-        base_type = ast_base.Array(base_type, int(type_len))
-    return base_type
+    return typecodec.parse_xi(type_str, type_len)
 
 
 def _normalize_type(s, loc, toks):
@@ -65,12 +33,16 @@ def _normalize_type(s, loc, toks):
     return toks
 
 
+_premods = ("calb", "normal")
+_postmods = ("serviceanswer", "serviceresult")
+
+
 def _build_normal_field():
     def normalize(s, loc, toks):
         return ast.NormalField(*toks)
 
-    premod = Optional(Or(("calb", "normal")), None)
-    postmod = Optional(Or(("serviceanswer", "serviceresult")), None)
+    premod = Optional(keywords(_premods), None)
+    postmod = Optional(keywords(_postmods), None)
     name_type_postmod = (_ctype + postmod + identifier + _array).setParseAction(_normalize_type)
     metalen = Optional("metalen", None)
     field = premod + name_type_postmod + metalen + Optional(doxygen.inline, [])
@@ -105,8 +77,116 @@ def _build_reserved_field():
 
 _reserved_field = _build_reserved_field()
 
+_ctype_pattern = re.compile(_ctype.re.pattern, re.IGNORECASE)
+_number_pattern = re.compile("[0-9]+")
+
+
+class _FastField(Token):
+    """
+    Hand-written tokenizer for plain normal and flagset fields, the bulk of the fields. It parses them the same
+    way _flagset_field | _normal_field do and fails on anything unusual, which is left to them.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.name = "field"
+        self.errmsg = "Expected field"
+        self.mayIndexError = False
+
+    def parseImpl(self, instring, loc, doActions=True):
+        result = _scan_field(instring, loc)
+        if result is None:
+            raise ParseException(instring, loc, self.errmsg, self)
+        return result
+
+
+def _skip(s, pos):
+    return blank_pattern.match(s, pos).end()
+
+
+def _scan_word(s, pos, words):
+    pos = _skip(s, pos)
+    for word in words:
+        if s.startswith(word, pos):
+            return word, pos + len(word)
+    return None, pos
+
+
+def _scan_field(s, loc):
+    premod, pos = _scan_word(s, loc, _premods)
+    match = _ctype_pattern.match(s, _skip(s, pos))
+    if match is None:
+        return None
+    type_str = match.group().lower()
+
+    flag, flag_end = _scan_word(s, match.end(), ("flag",))
+    if premod is None and flag:
+        # names starting with "flag" fall into here too, the grammar sorts them out
+        return _scan_flagset_field(s, flag_end, type_str)
+
+    postmod, pos = _scan_word(s, match.end(), _postmods)
+    if not postmod:
+        pos = match.end()
+    name = identifier_pattern.match(s, _skip(s, pos))
+    if name is None:
+        return None
+    length, pos = _scan_array(s, name.end())
+    if length is False:
+        return None
+    metalen, metalen_end = _scan_word(s, pos, ("metalen",))
+    if metalen:
+        pos = metalen_end
+    description, pos = _scan_inline(s, pos)
+    if description is None:
+        return None
+    return pos, ast.NormalField(premod, str2ast_type(type_str, length), postmod, name.group(), metalen, description)
+
+
+def _scan_flagset_field(s, pos, type_str):
+    name = identifier_pattern.match(s, _skip(s, pos))
+    if name is None:
+        return None
+    length, pos = _scan_array(s, name.end())
+    if length is False:
+        return None
+    of, pos = _scan_word(s, pos, ("of",))
+    flagset = of and identifier_pattern.match(s, _skip(s, pos))
+    if not flagset:
+        return None
+    description, pos = _scan_inline(s, flagset.end())
+    if description is None:
+        return None
+    return pos, ast.FlagsetField(str2ast_type(type_str, length), name.group(), flagset.group(), description)
+
+
+# Optional array length, length is False for anything but a well-formed one
+def _scan_array(s, pos):
+    start = _skip(s, pos)
+    if not s.startswith("[", start):
+        return None, pos
+    number = _number_pattern.match(s, _skip(s, start + 1))
+    end = number and _skip(s, number.end())
+    if not number or not s.startswith("]", end):
+        return False, pos
+    return number.group(), end + 1
+
+
+# Optional inline description, description is None for a malformed one
+def _scan_inline(s, pos):
+    start = _skip(s, pos)
+    if not s.startswith("/**", start):
+        return [], pos
+    start = _skip(s, start + 3)
+    if not s.startswith("<", start):
+        return [], pos
+    body = doxygen.comment_body.match(s, _skip(s, start + 1))
+    if body is None:
+        return None, pos
+    return doxygen.parse_description(body.group()), body.end() + 2
+
+
 # Order matters cause _normal_field is more general then _flagset_field
-_field = _flagset_field | _normal_field | _reserved_field
+_field = _FastField() | _flagset_field | _normal_field | _reserved_field
 
 
 def _build_roles():
@@ -128,7 +208,7 @@ def _build_roles():
     cid = QuotedString('"')
     size = Suppress("(") + Word(nums) + Suppress(")")
 
-    role = (Or("reader writer universal".split()) + cid + size).setParseAction(normalize)
+    role = (keywords(t.name for t in ast.RoleType) + cid + size).setParseAction(normalize)
 
     return Group(OneOrMore(role)).addCondition(validate)
 
@@ -1,8 +1,27 @@
-from pyparsing import Regex, Suppress, Or, ZeroOrMore
+import re
+
+from pyparsing import Regex, Suppress, ZeroOrMore
 
 from urpc.storage.oldxi import ast
 
-identifier = Regex("[A-Za-z][A-Za-z0-9_-]*")
+identifier_pattern = re.compile("[A-Za-z][A-Za-z0-9_-]*")
+identifier = Regex(identifier_pattern.pattern)
+# default pyparsing whitespace
+blank_pattern = re.compile("[ \t\r\n]*")
+
+
+def keywords(words, caseless=False):
+    """
+    Matches any of the words, the longest one wins. It is the same as Or of literals, but the words are matched
+    by a single regular expression instead of trying them one by one.
+    """
+    words = sorted(words, key=len, reverse=True)
+    pattern = "|".join(re.escape(w) for w in words)
+    if not caseless:
+        return Regex(pattern)
+    # matched words are returned as given, as CaselessLiteral does
+    spelling = {w.lower(): w for w in words}
+    return Regex(pattern, re.IGNORECASE).setParseAction(lambda s, loc, toks: spelling[toks[0].lower()])
 
 
 def _build_attribute_list():
@@ -10,7 +29,7 @@ def _build_attribute_list():
         attr = toks[0]
         return ast.Attribute[attr]
 
-    attr = Or(a.name for a in ast.Attribute).setParseAction(normalize)
+    attr = keywords(a.name for a in ast.Attribute).setParseAction(normalize)
     return attr + ZeroOrMore(Suppress(",") + attr)
 
 
@@ -1,7 +1,10 @@
 # from functools import lru_cache as memoize
+import re
 from collections import namedtuple
 
-from pyparsing import Regex, SkipTo, ParseException, OneOrMore, Optional, Suppress, Empty
+from pyparsing import Regex, ParseException, Optional, Suppress, Empty
+
+from urpc.storage.oldxi.common import blank_pattern
 
 Language = namedtuple("Language", ["code", "text"])
 
@@ -14,41 +17,56 @@ Language = namedtuple("Language", ["code", "text"])
 #
 # _text = Optional(_dname) + SkipTo(Or((Suppress(_dsee), Suppress(_dparam), StringEnd())), include=True)
 
+_language_open = re.compile(r"\\([a-zA-Z0-9]+?)\s")
+_language_close = re.compile(r"\\end([a-zA-Z0-9]+?)(\s|$)")
 
-def _build_language():
-    # TODO: use regexp backreference
-    def check_match(s, loc, toks):
-        start = toks[0].strip()
-        stop = toks[1][1].strip()
-        if start[1:] != stop[4:]:
-            raise ParseException("Language tags mismatch")
-        code = start[1:]
-        content = toks[1][0].strip()
-        return Language(code, content)
 
-    open_ = Regex(r"\\([a-zA-Z0-9]+?)\s")
-    close = Regex(r"\\end([a-zA-Z0-9]+?)(\s|$)")
+def _parse_languages(text):
+    # One or more "\code text \endcode" blocks making up the whole text, None if the text doesn't match
+    languages = []
+    pos = blank_pattern.match(text).end()
+    while pos < len(text) or not languages:
+        start = _language_open.match(text, pos)
+        stop = start and _language_close.search(text, start.end())
+        if not stop:
+            return None
+        code = start.group().strip()[1:]
+        if code != stop.group().strip()[4:]:
+            # language tags mismatch
+            return None
+        languages.append(Language(code, text[start.end():stop.start()].strip()))
+        pos = blank_pattern.match(text, stop.end()).end()
+    return languages
 
-    return (open_ + SkipTo(close, include=True)).setParseAction(check_match)
 
+def _is_meta(s):
+    for m in ("@param", "@name", "@see"):
+        if s.startswith(m):
+            return True
 
-_language = _build_language()
 
+def parse_description(comment):
+    """
+    Parses body of a description comment into a list of Language, returns None if it is malformed.
+    """
+    decommented = (ll.strip() for ll in comment.replace("*", "").split("\n"))
+    cleaned = " ".join(ll.strip() for ll in decommented if not _is_meta(ll))
+    return _parse_languages(cleaned)
 
-def _build_doxygen(spec):
-    def is_meta(s):
-        for m in ("@param", "@name", "@see"):
-            if s.startswith(m):
-                return True
 
+# comment body up to the closing "*/"
+comment_body = re.compile(r"[\s\S]*?(?=\*/)")
+
+
+def _build_doxygen(spec):
     def normalize(s, loc, toks):
-        decommented = (ll.strip() for ll in toks[0].replace("*", "").split("\n"))
-        cleaned = " ".join(ll.strip() for ll in decommented if not is_meta(ll))
-        languages = OneOrMore(_language).parseString(cleaned, parseAll=True)
+        languages = parse_description(toks[0])
+        if languages is None:
+            raise ParseException(s, loc, "Malformed description")
         return [languages]
 
     end = "*/"
-    return (Suppress(r"/**") + Suppress(spec) + SkipTo(end) + Suppress(end)).setParseAction(normalize)
+    return (Suppress(r"/**") + Suppress(spec) + Regex(comment_body.pattern) + Suppress(end)).setParseAction(normalize)
 
 
 # Exported
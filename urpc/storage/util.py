@@ -0,0 +1,14 @@
+import gc
+from contextlib import contextmanager
+
+
+# Loading allocates lots of long-living objects, collector passes over them are wasted
+@contextmanager
+def gc_paused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
@@ -2,79 +2,53 @@ from collections import Iterator
 from collections import OrderedDict
 from collections.abc import Mapping
 
+from urpc import ast
 
-# TODO: Lazy splitting is completely unnecessary and the implementation is awful. Refactor it out!
-class ProcessorIter(Iterator):
-    def __init__(self, processor, queue):
-        self._processor = processor
-        self._queue = queue
 
-    def __next__(self):
-        while True:
-            if len(self._queue):
-                return self._queue.pop(0)
-            if not self._processor():
-                raise StopIteration
+# Finds accessor counterpart of a command among the others, returns getter/setter tuple or None
+def _accessor_pair(cmd, cmd_by_cid):
+    first_letter = cmd.cid[0]
+    if first_letter not in ("g", "s"):
+        return None
+    other_cid = ("g" if first_letter == "s" else "s") + cmd.cid[1:]
+    other_cmd = cmd_by_cid.get(other_cid)
+    if other_cmd is None:
+        return None
+    setter, getter = (cmd, other_cmd) if first_letter == "s" else (other_cmd, cmd)
 
+    empty_setter_response = len(setter.response.args) == 0
+    empty_getter_request = len(getter.request.args) == 0
+    if not (empty_setter_response and empty_getter_request and setter.request.compare(getter.response)):
+        return None
+    return getter, setter
 
-class CommandIterMapping(Iterator):
-    def __init__(self, commands):
-        self._cmd_by_cid = OrderedDict([(cmd.cid, cmd) for cmd in commands])
 
-    def __next__(self):
-        try:
-            cmd = self._cmd_by_cid.popitem(False)[1]
-            return cmd
-        except KeyError:
-            raise StopIteration
-
-    # Tries to find accessor counterpart
-    # Returns setter/getter tuple and removes counterpart from iteration list in case of success
-    def pop_counterpart(self, cmd):
-        first_letter = cmd.cid[0]
-        if first_letter not in ("g", "s"):
-            raise ValueError("Has not getter/setter compatible CID!")
-        # setter, getter = cmd
-        other_cid = ("g" if first_letter == "s" else "s") + cmd.cid[1:]
-
-        if other_cid not in self._cmd_by_cid:
-            raise ValueError("Does not have counterpart!")
-
-        other_cmd = self._cmd_by_cid[other_cid]
-        setter, getter = (cmd, other_cmd) if first_letter == "s" else (other_cmd, cmd)
-
-        empty_setter_response = len(setter.response.args) == 0
-        empty_getter_request = len(getter.request.args) == 0
-        valid_sign = empty_setter_response and empty_getter_request and setter.request.compare(getter.response)
-
-        if not valid_sign:
-            raise ValueError("Does not conform to getter/setter pair signature!")
-        del self._cmd_by_cid[other_cid]
-        return getter, setter
-
-
-class Processor:
-    def __init__(self, all_commands, **buffers):
-        self._cmd_iter = CommandIterMapping(all_commands)
-        self._commands = buffers["commands"]
-        self._accessors = buffers["accessors"]
-
-    def __call__(self, *args, **kwargs):
-        try:
-            cmd = next(self._cmd_iter)
-            try:
-                self._accessors.append(self._cmd_iter.pop_counterpart(cmd))
-            except ValueError:
-                self._commands.append(cmd)
-            return True
-        except StopIteration:
-            return False
+def _split_by_type(all_commands):
+    cmd_by_cid = OrderedDict((cmd.cid, cmd) for cmd in all_commands)
+    commands, accessors = [], []
+    # CIDs of counterparts already taken by accessors
+    paired = set()
+    for cid, cmd in cmd_by_cid.items():
+        if cid in paired:
+            continue
+        pair = _accessor_pair(cmd, cmd_by_cid)
+        if pair is None:
+            commands.append(cmd)
+        else:
+            accessors.append(pair)
+            paired.add(pair[1].cid if pair[0] is cmd else pair[0].cid)
+    return tuple(commands), tuple(accessors)
 
 
 def split_by_type(all_commands):
-    commands, accessors = [], []
-    active = Processor(all_commands, commands=commands, accessors=accessors)
-    return ProcessorIter(active, commands), ProcessorIter(active, accessors)
+    """
+    Splits commands into plain commands and getter/setter pairs of accessors, both in the order of CIDs
+    appearance. Results for protocol's commands are memoized until the protocol changes.
+    """
+    protocol = getattr(all_commands, "node", None)
+    if isinstance(protocol, ast.Protocol):
+        return protocol.memoize(split_by_type, lambda: _split_by_type(all_commands))
+    return _split_by_type(all_commands)
 
 
 class LazyGroup(Iterator):
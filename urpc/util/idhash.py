@@ -1,4 +1,6 @@
 class IdentityHash:
+    __slots__ = ()
+
     def __eq__(self, other):
         return id(self) == id(other)
 
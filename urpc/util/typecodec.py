@@ -0,0 +1,146 @@
+"""
+Conversions between field types and their notations:
+
+    C declarations      uint8_t, int32_t, float, int32_t name[4]
+    JSON type strings   uint8, int32, float, int32[4]
+    old .xi types       int8u, int32s, float, byte, char, cfloat, cdfloat
+
+Notations are parsed with precompiled patterns and conversions are cached, so storages and builders may convert
+types of every argument without building anything per call.
+"""
+import re
+from functools import lru_cache
+
+from urpc import ast
+
+# the first notation of a type is the one it is formatted with
+c_types = (
+    ("uint8_t", ast.Integer8u),
+    ("uint16_t", ast.Integer16u),
+    ("uint32_t", ast.Integer32u),
+    ("uint64_t", ast.Integer64u),
+    ("int8_t", ast.Integer8s),
+    ("int16_t", ast.Integer16s),
+    ("int32_t", ast.Integer32s),
+    ("int64_t", ast.Integer64s),
+    ("float", ast.Float),
+)
+json_types = (
+    ("uint8", ast.Integer8u),
+    ("uint16", ast.Integer16u),
+    ("uint32", ast.Integer32u),
+    ("uint64", ast.Integer64u),
+    ("int8", ast.Integer8s),
+    ("int16", ast.Integer16s),
+    ("int32", ast.Integer32s),
+    ("int64", ast.Integer64s),
+    ("float", ast.Float),
+)
+xi_types = (
+    ("int8u", ast.Integer8u),
+    ("int16u", ast.Integer16u),
+    ("int32u", ast.Integer32u),
+    ("int64u", ast.Integer64u),
+    ("int8s", ast.Integer8s),
+    ("int16s", ast.Integer16s),
+    ("int32s", ast.Integer32s),
+    ("int64s", ast.Integer64s),
+    ("float", ast.Float),
+    ("byte", ast.Integer8u),
+    ("char", ast.Integer8s),
+    ("cfloat", ast.Float),
+    ("cdfloat", ast.Float),
+)
+
+
+def _names(types):
+    # longest first, so no name is taken for a prefix of another one
+    return "|".join(sorted((re.escape(name) for name, _ in types), key=len, reverse=True))
+
+
+# C declaration with an optional identifier and array length, e.g. int32_t abcd[42]
+_c_pattern = re.compile(
+    r"(?P<type>" + _names(c_types) + r")(?: (?P<name>[_a-zA-Z][_a-zA-Z0-9]*))?(?:\[(?P<length>[0-9]+)\])?$"
+)
+_json_pattern = re.compile(r"(?P<type>" + _names(json_types) + r")(?:\[(?P<length>[0-9]+)\])?$")
+
+_c_by_name = dict(c_types)
+_json_by_name = dict(json_types)
+_xi_by_name = dict(xi_types)
+_c_by_type = dict((t, name) for name, t in reversed(c_types))
+_json_by_type = dict((t, name) for name, t in reversed(json_types))
+_xi_by_type = dict((t, name) for name, t in reversed(xi_types))
+
+
+def _array(base, length):
+    return ast.ArrayType(base, int(length)) if length else base
+
+
+# base type and array length suffix, "" for scalars
+def _split(type_obj, names):
+    suffix = ""
+    if isinstance(type_obj, ast.ArrayType):
+        suffix = "[{}]".format(len(type_obj))
+        type_obj = type_obj.type_
+    try:
+        return names[type_obj], suffix
+    except (KeyError, TypeError):
+        raise ValueError("Unknown type class supplied")
+
+
+@lru_cache(maxsize=1024)
+def parse_c(decl, array_length=None):
+    """
+    Parses a C type or declaration. Array length of the declaration takes precedence over the array_length given.
+    """
+    base = _c_by_name.get(decl)
+    if base is None:
+        match = _c_pattern.match(decl)
+        if match is None:
+            raise ValueError("Wrong C type supplied")
+        base = _c_by_name[match.group("type")]
+        array_length = match.group("length") or array_length
+    return _array(base, array_length)
+
+
+@lru_cache(maxsize=1024)
+def format_c(type_obj, identifier=None):
+    """
+    Returns a declaration of the identifier, or a tuple of the base C type and array length suffix without one.
+    """
+    base, suffix = _split(type_obj, _c_by_type)
+    if identifier:
+        return "{} {}{}".format(base, identifier, suffix)
+    return base, suffix
+
+
+@lru_cache(maxsize=1024)
+def parse_json(text):
+    match = _json_pattern.match(text)
+    if match is None:
+        raise ValueError("Unknown type {}".format(text))
+    return _array(_json_by_name[match.group("type")], match.group("length"))
+
+
+@lru_cache(maxsize=1024)
+def format_json(type_obj):
+    return "".join(_split(type_obj, _json_by_type))
+
+
+@lru_cache(maxsize=1024)
+def parse_xi(token, array_length=None):
+    """
+    Parses a lower case .xi type, arrays have their length next to the field name in .xi.
+    """
+    try:
+        return _array(_xi_by_name[token], array_length)
+    except KeyError:
+        raise ValueError("Wrong C type supplied")
+
+
+@lru_cache(maxsize=1024)
+def format_xi(type_obj):
+    """
+    Returns a tuple of the .xi type and array length suffix.
+    """
+    return _split(type_obj, _xi_by_type)